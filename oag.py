@@ -7,14 +7,43 @@ homepage: https://github.com/zealmult/OpenAccess-Guard/
 version: 0.2.2
 """
 
+import asyncio
+import bisect
 import copy
+import csv
+import heapq
 import json
+import math
+import mmap
+import os
 import random
+import re
+import string
+import sys
+import threading
 import time
-from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+import tracemalloc
+from collections import OrderedDict, deque
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
 from pydantic import BaseModel, Field
 
+try:
+    import numpy as np
+except ImportError:  # optional, only needed for `reporting`
+    np = None
+
 # ============================================================
 # Default Configuration
 # ============================================================
@@ -99,37 +128,805 @@ DEFAULT_CONFIG: Dict[str, Any] = {
         "user_dict": False,
     },
     "ads": {"enabled": False, "content": []},
+    "reporting": {"enabled": False},  # Columnar usage log (needs numpy)
+    # Time-to-first-token and tokens/sec histograms per model group.
+    "telemetry": {"enabled": False},
+    # Identical requests (same user, model and trailing messages) within
+    # `window` seconds: "reject" them, or "notify" and let them through.
+    "dedup": {
+        "enabled": False,
+        "window": 2,
+        "messages": 2,
+        "action": "reject",
+        "max_entries": 10000,
+    },
+    # Latency-driven limits: shrink rpm/rph/window limits (lowest-priority
+    # user groups first) while a model group's latency is over target.
+    "adaptive": {
+        "enabled": False,
+        "target_latency": 30,
+        "min_factor": 0.2,
+        "decrease": 0.5,
+        "increase": 0.1,
+        "interval": 10,
+    },
     "custom_strings": {
         "whitelist_deny": "Access Denied: Not in whitelist.",
         "tier_mismatch": "Tier Mismatch. User Tier {u_tier} cannot access Model Tier {m_tier}",
         "user_deny_model": "Tier {u_tier} users cannot use model {model_id}",
         "model_wl_deny": "Access Denied to Tier {m_tier} Model (Whitelist)",
         "model_bl_deny": "Access Denied to Tier {m_tier} Model (Blacklist)",
-        "rate_limit_deny": "Rate Limit Exceeded: {reason}",
+        "rate_limit_deny": "Rate Limit Exceeded: {reason}. Retry in {retry_after}s.",
         # NEW: Group system messages
         "group_no_permission": "Access Denied: User group '{u_group}' cannot access model group '{m_group}'",
+        "duplicate_deny": "Duplicate request ignored: the same message was sent less than {window}s ago.",
     },
 }
 
 
+# ============================================================
+# Compiled Policy
+# ============================================================
+class _Limits:
+    """Numeric limits resolved from a permissions (or legacy tier) dict."""
+
+    __slots__ = ("raw", "rpm", "rph", "win_time", "win_limit", "clip")
+
+    def __init__(
+        self,
+        raw: Dict[str, Any],
+        rpm: float = 0,
+        rph: float = 0,
+        win_time: float = 0,
+        win_limit: float = 0,
+        clip: int = 0,
+    ):
+        self.raw = raw
+        self.rpm = rpm
+        self.rph = rph
+        self.win_time = win_time
+        self.win_limit = win_limit
+        self.clip = clip
+
+
+class _Permission(_Limits):
+    """One cell of the (user group x model group) permission matrix."""
+
+    __slots__ = (
+        "enabled",
+        "denied",
+        "deny_msg",
+        "source",
+        "source_name",
+        "clip_bytes",
+        "strip_attachments",
+    )
+
+
+class _UserGroupPolicy:
+    __slots__ = ("index", "id", "name", "label", "priority", "rank", "raw")
+
+
+class _ModelGroupPolicy:
+    # fallback: ordered (model id, target group or None, max in-flight or 0)
+    # routing: None, "least_inflight" or "least_latency" over `replicas`
+    __slots__ = (
+        "index",
+        "id",
+        "name",
+        "label",
+        "raw",
+        "fallback",
+        "routing",
+        "replicas",
+    )
+
+
+class _PoolPolicy:
+    """
+    One entry of `pools`: a quota shared by every member of some user groups,
+    optionally only on some model groups. Hits live in one history per pool.
+    """
+
+    __slots__ = ("id", "name", "limits", "user_groups", "model_groups")
+
+
+class _Policy:
+    """
+    Flat, validated view of one config snapshot.
+    `matrix[user_group.index][model_group.index + 1]` holds the effective
+    permissions; column 0 is used for ungrouped models.
+    `pool_matrix[user_group.index][model_group.index]` lists the pools a
+    request draws from (None when no pools are configured).
+    """
+
+    __slots__ = (
+        "cfg",
+        "enabled",
+        "admin_effective",
+        "legacy",
+        "exemption",
+        "auth_domains",
+        "auth_deny_msg",
+        "whitelist",
+        "bans",
+        "ban_files",
+        "user_groups",
+        "user_index",
+        "user_domains",
+        "user_files",
+        "membership_files",
+        "default_user_group",
+        "model_groups",
+        "model_index",
+        "model_patterns",
+        "model_cache",
+        "matrix",
+        "global_limit",
+        "fallback_enabled",
+        "fallback_model",
+        "fallback_notify",
+        "fallback_notify_msg",
+        "ads",
+        "strings",
+        "state_migration",
+        "reporting",
+        "track_inflight",
+        "adaptive",
+        "telemetry",
+        "pools",
+        "pool_matrix",
+        "dedup",
+    )
+
+
+class _MembershipFile:
+    """
+    Email list kept in a local file: plain text (one entry per line, `#`
+    comments) or CSV (the `email` column if the header has one, otherwise the
+    first column). The file is read through mmap into a frozenset once;
+    `poll()` re-indexes it in a background thread only when its mtime changes,
+    and the previous set keeps serving lookups until the new one is swapped in.
+    """
+
+    __slots__ = ("path", "entries", "mtime", "version", "loading", "error")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: frozenset = frozenset()
+        self.mtime: Optional[int] = None
+        self.version = 0
+        self.loading = False
+        self.error: Optional[str] = None
+
+    def load(self) -> None:
+        mtime = os.stat(self.path).st_mtime_ns
+        self.entries = self._read()
+        self.mtime = mtime
+        self.version += 1
+        self.error = None
+
+    def poll(self) -> None:
+        if self.loading:
+            return
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError as e:
+            # Keep serving the last good index until the file is back.
+            self.error = str(e)
+            return
+        if mtime == self.mtime:
+            return
+        self.loading = True
+        threading.Thread(
+            target=self._reload, name="oag-membership-reload", daemon=True
+        ).start()
+
+    def _reload(self) -> None:
+        try:
+            self.load()
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            self.loading = False
+
+    def _read(self) -> frozenset:
+        with open(self.path, "rb") as fh:
+            if os.fstat(fh.fileno()).st_size == 0:
+                return frozenset()
+            with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                lines = (
+                    line.decode("utf-8", "replace").lstrip("\ufeff")
+                    for line in iter(mm.readline, b"")
+                )
+                if self.path.casefold().endswith(".csv"):
+                    return self._parse_csv(lines)
+                entries = set()
+                for line in lines:
+                    email = line.strip().casefold()
+                    if email and not email.startswith("#"):
+                        entries.add(email)
+                return frozenset(entries)
+
+    @staticmethod
+    def _parse_csv(lines: Any) -> frozenset:
+        entries = set()
+        column = 0
+        first = True
+        for row in csv.reader(lines):
+            if not row or row[0].lstrip().startswith("#"):
+                continue
+            if first:
+                first = False
+                header = [cell.strip().casefold() for cell in row]
+                if "email" in header:
+                    column = header.index("email")
+                    continue
+            if column < len(row):
+                email = row[column].strip().casefold()
+                if email:
+                    entries.add(email)
+        return frozenset(entries)
+
+
+class _MembershipSet:
+    """Inline emails plus any `files` entries of a config section."""
+
+    __slots__ = ("inline", "files")
+
+    def __init__(self, inline: Set[str], files: List[_MembershipFile]):
+        self.inline = inline
+        self.files = files
+
+    def __contains__(self, email: str) -> bool:
+        if email in self.inline:
+            return True
+        for f in self.files:
+            if email in f.entries:
+                return True
+        return False
+
+
+class _DomainTrie:
+    """
+    Reversed-domain trie for `user_groups[].emails` domain rules
+    ("*@corp.com" matches that domain, "*@*.corp.com" any subdomain of it).
+    Each node keeps the best (rank, group_index) for an exact-domain rule and
+    for a subdomain rule, so a lookup costs one dict step per domain label.
+    Lower rank wins; rules must be inserted in rank order.
+    """
+
+    __slots__ = ("children", "exact", "subdomains")
+
+    def __init__(self):
+        self.children: Dict[str, "_DomainTrie"] = {}
+        self.exact: Optional[Tuple[int, int]] = None
+        self.subdomains: Optional[Tuple[int, int]] = None
+
+    def insert(self, domain: str, subdomains: bool, rank: int, group: int) -> None:
+        node = self
+        for label in reversed(domain.split(".")):
+            child = node.children.get(label)
+            if child is None:
+                child = node.children[label] = _DomainTrie()
+            node = child
+        if subdomains:
+            if node.subdomains is None:
+                node.subdomains = (rank, group)
+        elif node.exact is None:
+            node.exact = (rank, group)
+
+    def lookup(self, domain: str) -> Optional[int]:
+        labels = domain.split(".")
+        node = self
+        best: Optional[Tuple[int, int]] = None
+        for i in range(len(labels) - 1, -1, -1):
+            node = node.children.get(labels[i])
+            if node is None:
+                break
+            candidate = node.exact if i == 0 else node.subdomains
+            if candidate is not None and (best is None or candidate < best):
+                best = candidate
+        return best[1] if best is not None else None
+
+
+class _ModelPatternIndex:
+    """
+    Glob / regex entries of `model_groups[].models` for one config snapshot.
+    Globs are bucketed by their literal prefix (or, for "*..." globs, their
+    literal suffix), so a lookup slices the id once per distinct literal
+    length and only runs the regex of patterns whose fixed part matched.
+    Entries with no literal anchor and "re:" entries are checked in order.
+    Regexes are compiled on first use, so large pattern lists load quickly.
+    """
+
+    __slots__ = (
+        "prefixes",
+        "prefix_lengths",
+        "suffixes",
+        "suffix_lengths",
+        "unanchored",
+        "compiled",
+    )
+
+    def __init__(self):
+        self.prefixes: Dict[str, List[Tuple[int, str]]] = {}
+        self.prefix_lengths: List[int] = []
+        self.suffixes: Dict[str, List[Tuple[int, str]]] = {}
+        self.suffix_lengths: List[int] = []
+        self.unanchored: List[Tuple[int, str]] = []
+        self.compiled: Dict[str, Any] = {}
+
+    def add(self, group_index: int, source: str, prefix: str, suffix: str) -> None:
+        entry = (group_index, source)
+        if prefix:
+            self.prefixes.setdefault(prefix, []).append(entry)
+        elif suffix:
+            self.suffixes.setdefault(suffix, []).append(entry)
+        else:
+            self.unanchored.append(entry)
+
+    def finalize(self) -> None:
+        self.prefix_lengths = sorted({len(k) for k in self.prefixes})
+        self.suffix_lengths = sorted({len(k) for k in self.suffixes})
+        self.unanchored.sort(key=lambda e: e[0])
+
+    def _fullmatch(self, source: str, value: str) -> bool:
+        compiled = self.compiled.get(source)
+        if compiled is None:
+            compiled = self.compiled[source] = re.compile(source, re.IGNORECASE)
+        return compiled.fullmatch(value) is not None
+
+    def match(self, variants: Set[str], best: Optional[int]) -> Optional[int]:
+        """Lowest matching group index, considering only groups before `best`."""
+        for raw in variants:
+            variant = raw.casefold()
+            size = len(variant)
+            candidates: List[Tuple[int, str]] = []
+            for length in self.prefix_lengths:
+                if length > size:
+                    break
+                bucket = self.prefixes.get(variant[:length])
+                if bucket:
+                    candidates.extend(bucket)
+            for length in self.suffix_lengths:
+                if length > size:
+                    break
+                bucket = self.suffixes.get(variant[size - length :])
+                if bucket:
+                    candidates.extend(bucket)
+            for idx, source in candidates:
+                if (best is None or idx < best) and self._fullmatch(source, variant):
+                    best = idx
+            for idx, source in self.unanchored:
+                if best is not None and idx >= best:
+                    break
+                if self._fullmatch(source, variant):
+                    best = idx
+                    break
+        return best
+
+
+class _StaticDecision:
+    """Memoized identity/model part of an inlet decision."""
+
+    __slots__ = ("kind", "message", "user_group", "model_group", "perm")
+
+    def __init__(
+        self,
+        kind: str,
+        message: Optional[str] = None,
+        user_group: Optional[_UserGroupPolicy] = None,
+        model_group: Optional[_ModelGroupPolicy] = None,
+        perm: Optional[_Permission] = None,
+    ):
+        self.kind = kind
+        self.message = message
+        self.user_group = user_group
+        self.model_group = model_group
+        self.perm = perm
+
+
+class _UsageLog:
+    """
+    Columnar log of recorded hits for usage reports: parallel NumPy arrays of
+    timestamp, user index, user group index and model group index, appended
+    in time order. Entries older than a day are compacted away whenever the
+    arrays are full, so memory tracks the last day of traffic.
+    """
+
+    WINDOWS = (("minute", 60), ("hour", 3600), ("day", 86400))
+    RETENTION = 86400
+
+    __slots__ = ("size", "columns", "users", "user_names", "groups", "group_names")
+
+    def __init__(self, capacity: int = 1 << 16):
+        self.size = 0
+        # ts, user, user group, model group
+        self.columns = [
+            np.empty(capacity, dtype=np.float64),
+            np.empty(capacity, dtype=np.int32),
+            np.empty(capacity, dtype=np.int32),
+            np.empty(capacity, dtype=np.int32),
+        ]
+        self.users: Dict[str, int] = {}
+        self.user_names: List[str] = []
+        # User and model group ids share one table.
+        self.groups: Dict[str, int] = {}
+        self.group_names: List[str] = []
+
+    @staticmethod
+    def _intern(table: Dict[str, int], names: List[str], name: str) -> int:
+        idx = table.get(name)
+        if idx is None:
+            idx = table[name] = len(names)
+            names.append(name)
+        return idx
+
+    def record(
+        self, now: float, user_id: str, user_group: str, model_group: str
+    ) -> None:
+        if self.size == len(self.columns[0]):
+            self._compact(now)
+        i = self.size
+        ts, user, ug, mg = self.columns
+        ts[i] = now
+        user[i] = self._intern(self.users, self.user_names, user_id)
+        ug[i] = self._intern(self.groups, self.group_names, user_group)
+        mg[i] = self._intern(self.groups, self.group_names, model_group)
+        self.size = i + 1
+
+    def _compact(self, now: float) -> None:
+        ts = self.columns[0]
+        start = int(
+            np.searchsorted(ts[: self.size], now - self.RETENTION, side="right")
+        )
+        kept = self.size - start
+        capacity = len(ts) * 2 if kept * 2 > len(ts) else len(ts)
+        for i, col in enumerate(self.columns):
+            grown = np.empty(capacity, dtype=col.dtype)
+            grown[:kept] = col[start : self.size]
+            self.columns[i] = grown
+        self.size = kept
+
+    def snapshot(self) -> Tuple[List[Any], List[str], List[str]]:
+        """Copy of the live rows; cheap enough to take on the event loop."""
+        return (
+            [col[: self.size].copy() for col in self.columns],
+            list(self.user_names),
+            list(self.group_names),
+        )
+
+    @classmethod
+    def aggregate(
+        cls, snapshot: Tuple[List[Any], List[str], List[str]], now: float
+    ) -> Dict[str, Any]:
+        (ts, user, ug, mg), user_names, group_names = snapshot
+        user_names = np.asarray(user_names, dtype=object)
+        group_names = np.asarray(group_names, dtype=object)
+
+        def count(column: Any, names: Any) -> Dict[str, int]:
+            counts = np.bincount(column, minlength=len(names))
+            hit = np.flatnonzero(counts)
+            return dict(zip(names[hit].tolist(), counts[hit].tolist()))
+
+        report: Dict[str, Any] = {"generated_at": now}
+        for name, span in cls.WINDOWS:
+            start = int(np.searchsorted(ts, now - span, side="right"))
+            report[name] = {
+                "total": int(len(ts) - start),
+                "users": count(user[start:], user_names),
+                "user_groups": count(ug[start:], group_names),
+                "model_groups": count(mg[start:], group_names),
+            }
+        return report
+
+
+class _QuotaProbe:
+    """
+    Read-only view of one set of limits against a hit history: requests left
+    per window (None = unlimited), the first exhausted window ("RPM", "RPH",
+    "Window") if any, and seconds until every exhausted window has a slot.
+    """
+
+    __slots__ = ("remaining", "exhausted", "retry_after", "frees_at")
+
+    def __init__(self):
+        self.remaining: Dict[str, Optional[int]] = {
+            "rpm": None,
+            "rph": None,
+            "window": None,
+        }
+        self.exhausted: Optional[str] = None
+        self.retry_after = 0.0
+        # (window label, time its next slot frees) for each exhausted window
+        self.frees_at: List[Tuple[str, float]] = []
+
+
+class _InflightTracker:
+    """
+    Requests currently being answered, per target model id. `inlet` starts an
+    entry and `outlet` finishes it, paired by a request key (see
+    `Filter._request_key`). Entries whose outlet never arrives (aborted or
+    failed requests) expire after `ttl` seconds so counts cannot leak.
+    """
+
+    # Weight of the newest sample in the per-model latency average.
+    LATENCY_ALPHA = 0.2
+
+    __slots__ = ("ttl", "requests", "by_model", "latency", "streams")
+
+    def __init__(self, ttl: float = 600.0):
+        self.ttl = ttl
+        # key -> (model, start time, model group id or None)
+        self.requests: Dict[Any, Tuple[str, float, Optional[str]]] = {}
+        self.by_model: Dict[str, Dict[Any, float]] = {}
+        # model -> exponentially weighted inlet-to-outlet seconds
+        self.latency: Dict[str, float] = {}
+        # key -> [first chunk time, last chunk time, chunks, usage tokens]
+        self.streams: Dict[Any, List[Any]] = {}
+
+    def start(
+        self, key: Any, model: str, now: float, group: Optional[str] = None
+    ) -> None:
+        # A key that is still in flight (a resent message, or a client that
+        # sends no ids) never reached its outlet: drop it without a sample.
+        self.discard(key)
+        # Keys are in start order, so expired entries sit at the front. Swept
+        # here too, as only routing and fallback caps ever call `count`.
+        requests = self.requests
+        while requests:
+            oldest = next(iter(requests))
+            if now - requests[oldest][1] < self.ttl:
+                break
+            self.discard(oldest)
+        requests[key] = (model, now, group)
+        self.by_model.setdefault(model, {})[key] = now
+
+    def finish(
+        self, key: Any, now: float
+    ) -> Optional[Tuple[str, float, Optional[str]]]:
+        """Returns (model, seconds since start, group) if `key` was in flight."""
+        entry = self.discard(key)
+        if entry is None:
+            return None
+        model, started, group = entry
+        elapsed = now - started
+        previous = self.latency.get(model)
+        self.latency[model] = (
+            elapsed
+            if previous is None
+            else previous + self.LATENCY_ALPHA * (elapsed - previous)
+        )
+        return model, elapsed, group
+
+    def discard(self, key: Any) -> Optional[Tuple[str, float, Optional[str]]]:
+        """Forget `key` without recording latency; returns its entry."""
+        self.streams.pop(key, None)
+        entry = self.requests.pop(key, None)
+        if entry is not None:
+            active = self.by_model.get(entry[0])
+            if active is not None:
+                active.pop(key, None)
+        return entry
+
+    def count(self, model: str, now: float) -> int:
+        active = self.by_model.get(model)
+        if not active:
+            return 0
+        # Keys are in start order, so stale entries sit at the front.
+        while active:
+            key = next(iter(active))
+            if now - active[key] < self.ttl:
+                break
+            self.discard(key)
+        return len(active)
+
+
+class _Histogram:
+    """Fixed-bucket histogram (upper bounds, last bucket is +inf)."""
+
+    __slots__ = ("bounds", "counts", "count", "total")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def snapshot(self) -> Dict[str, Any]:
+        buckets = {str(b): c for b, c in zip(self.bounds, self.counts)}
+        buckets["+inf"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "buckets": buckets,
+        }
+
+
+class _AdaptiveConfig:
+    """Compiled `adaptive` section."""
+
+    __slots__ = (
+        "target_latency",
+        "targets",
+        "min_factor",
+        "decrease",
+        "increase",
+        "interval",
+        "order",
+    )
+
+
+class _DedupConfig:
+    """Compiled `dedup` section."""
+
+    __slots__ = ("window", "messages", "action", "max_entries")
+
+
+class _AdaptiveState:
+    """
+    AIMD state of one model group: average latency and the limit factor of
+    each user group (missing = 1.0), plus scaled permissions for the current
+    factors.
+    """
+
+    __slots__ = ("latency", "factors", "next_adjust", "scaled")
+
+    def __init__(self):
+        self.latency: Optional[float] = None
+        self.factors: Dict[str, float] = {}
+        self.next_adjust = 0.0
+        self.scaled: Dict[Tuple[int, float], _Permission] = {}
+
+
+class _ClipState:
+    """
+    Where the last clip of one chat left off: the messages list it came from
+    (`source` path in body), its length, a hash of the role and content of
+    those messages (see `Filter._message_keys`; attachments are not kept
+    alive), the indices of system messages and of the kept (last `clip`)
+    non-system messages.
+    """
+
+    __slots__ = ("source", "clip", "count", "prefix", "system", "kept")
+
+
+_MESSAGE_KEYS = (
+    "messages",
+    "history",
+    "chat_history",
+    "conversation_messages",
+    "all_messages",
+)
+# Places in `body` a messages list may come from, in the order they are tried.
+_MESSAGE_SOURCES: Tuple[Tuple[str, ...], ...] = (
+    tuple((k,) for k in _MESSAGE_KEYS)
+    + tuple(("metadata", k) for k in _MESSAGE_KEYS)
+    + (("chat", "messages"),)
+    + tuple(("conversation", k) for k in _MESSAGE_KEYS)
+    + tuple(("data", k) for k in _MESSAGE_KEYS)
+)
+
+# Placeholders each formatted custom string may reference.
+_STRING_PLACEHOLDERS: Dict[str, Set[str]] = {
+    "tier_mismatch": {"u_tier", "m_tier"},
+    "user_deny_model": {"u_tier", "model_id"},
+    "model_wl_deny": {"m_tier"},
+    "model_bl_deny": {"m_tier"},
+    "rate_limit_deny": {"reason", "retry_after"},
+    "group_no_permission": {"u_group", "m_group"},
+    "duplicate_deny": {"window"},
+}
+
+
 # ============================================================
 # Filter Logic
 # ============================================================
 class Filter:
+    # Max (email, model) entries kept in the static-decision LRU.
+    _STATIC_CACHE_MAX = 8192
+    # Max model ids whose model-group lookup is cached per config snapshot.
+    _MODEL_CACHE_MAX = 4096
+    # Seconds between mtime checks of external membership files.
+    _MEMBERSHIP_POLL_INTERVAL = 5.0
+    # Histogram upper bounds for stream telemetry.
+    _TTFT_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0)
+    _TPS_BUCKETS = (1.0, 5.0, 10.0, 20.0, 50.0, 100.0, 200.0, 500.0)
+    # Content part types `strip_attachments` replaces, by placeholder name.
+    _ATTACHMENT_PARTS = {
+        "image_url": "image",
+        "input_image": "image",
+        "image": "image",
+        "file": "file",
+        "input_file": "file",
+        "input_audio": "audio",
+    }
+    # Max chats whose last clip boundary is remembered.
+    _CLIP_CACHE_MAX = 4096
+    # Concurrent background status-event sends, and seconds each may take.
+    _EMIT_MAX_PENDING = 256
+    _EMIT_TIMEOUT = 5.0
+    # Max "blocked until" entries kept for rejected (user, key) pairs.
+    _BLOCKED_MAX = 65536
+
     class Valves(BaseModel):
         config_json: str = Field(
             default=json.dumps(DEFAULT_CONFIG, indent=2, ensure_ascii=False),
             description="Please open https://oag.breathai.top to generate the configuration file. (Supports // and /* */ comments.)",
         )
 
-    def __init__(self):
+    def __init__(self, clock: Optional[Callable[[], float]] = None):
         self.valves = self.Valves()
         self.user_history: Dict[str, Dict[str, List[float]]] = {}
         self._warned_multiple_default_groups = False
+        # Injectable time source (seconds since epoch). Simulators drive a
+        # virtual clock through here instead of waiting on wall time.
+        self._clock: Callable[[], float] = clock or time.time
+        # Last compiled config, reused while `config_json` is unchanged.
+        self._cfg_raw: Optional[str] = None
+        self._policy: Optional[_Policy] = None
+        # path -> loaded membership file, shared across config versions.
+        self._membership_files: Dict[str, _MembershipFile] = {}
+        self._membership_version = 0
+        self._membership_next_poll = 0.0
+        # (normalized email, model id) -> static decision for the current config.
+        self._static_cache: "OrderedDict[Tuple[str, str], _StaticDecision]" = (
+            OrderedDict()
+        )
+        # Registered `state_migration` entries (old key, new keys), and per user
+        # how many of them have already been applied to their history.
+        self._migrations: List[Tuple[str, Tuple[str, ...]]] = []
+        self._migrations_seen: Set[Tuple[str, Tuple[str, ...]]] = set()
+        self._migrated_upto: Dict[str, int] = {}
+        # Quota resets: a generation counter, the generation of the last reset
+        # of each scope, and per user the generation their history was last
+        # checked against. Stale histories are cleared when next read.
+        self._generation = 0
+        self._reset_all = 0
+        self._reset_users: Dict[str, int] = {}
+        self._reset_user_groups: Dict[str, int] = {}
+        self._reset_keys: Dict[str, int] = {}
+        self._reset_seen: Dict[str, int] = {}
+        # (tier sections, model groups, user groups) of the last v0.1 migration.
+        self._legacy_migration: Optional[Tuple[Any, List[Any], List[Any]]] = None
+        # Columnar hit log behind `usage_report`, while `reporting` is enabled.
+        self._usage: Optional[_UsageLog] = None
+        # (user id, history key) -> (permission, exhausted windows and when
+        # they free up), recorded when a request is rejected for its limits.
+        self._blocked: Dict[
+            Tuple[str, str], Tuple[_Permission, List[Tuple[str, float]]]
+        ] = {}
+        self._short_circuited = 0
+        # (user id, model id, trailing messages hash) -> expiry, for `dedup`;
+        # expiries are in insertion order, so stale entries sit at the front.
+        self._dedup: "OrderedDict[Tuple[str, str, int], float]" = OrderedDict()
+        self._dedup_hits = 0
+        # Background status-event sends (see `_emit`) and how many were lost.
+        self._emit_tasks: Set["asyncio.Future[None]"] = set()
+        self._emit_dropped = 0
+        # chat id -> where its last clip left off, for incremental clipping.
+        self._clip_cache: "OrderedDict[Any, _ClipState]" = OrderedDict()
+        # pool id -> time-sorted hits of every member, shared by all of them.
+        self._pool_history: Dict[str, List[float]] = {}
+        # In-flight requests per target model, for load-aware fallback.
+        self._inflight = _InflightTracker()
+        # model group id -> AIMD state for `adaptive`.
+        self._adaptive: Dict[str, _AdaptiveState] = {}
+        # model group id -> {"ttft" | "tokens_per_second": histogram}
+        self._telemetry: Dict[str, Dict[str, _Histogram]] = {}
 
     # ----------------------------
     # Small helpers
     # ----------------------------
+    def _now(self) -> float:
+        return self._clock()
+
     @staticmethod
     def _normalize_email(email: Any) -> str:
         if email is None:
@@ -227,6 +1024,8 @@ class Filter:
     # ----------------------------
     # Migration / Validation
     # ----------------------------
+    _LEGACY_SECTIONS = ("user_tiers", "model_tiers", "model_tiers_config")
+
     def _migrate_config_to_groups(self, cfg: Dict[str, Any]) -> Dict[str, Any]:
         """
         Automatically migrate old tier-based configuration to new group-based configuration.
@@ -240,6 +1039,14 @@ class Filter:
         if not isinstance(cfg.get("user_tiers"), list) or len(cfg["user_tiers"]) == 0:
             return cfg
 
+        # Tier sections are usually large and rarely edited: reuse the last
+        # migration while they are unchanged.
+        legacy_sections = tuple(cfg.get(k) for k in self._LEGACY_SECTIONS)
+        cached = self._legacy_migration
+        if cached is not None and cached[0] == legacy_sections:
+            cfg["model_groups"], cfg["user_groups"] = cached[1], cached[2]
+            return cfg
+
         self._log(
             cfg,
             "OAG",
@@ -247,21 +1054,52 @@ class Filter:
             "Detected v0.1.x config, migrating to Group system...",
         )
 
-        # === Migrate Model Tiers to Model Groups ===
-        model_groups: List[Dict[str, Any]] = []
-        for tier in (
+        model_tiers = (
             cfg.get("model_tiers", [])
             if isinstance(cfg.get("model_tiers"), list)
             else []
-        ):
+        )
+        match_tiers = cfg.get("model_tiers_config", {}).get("match_tiers", False)
+
+        # === Migrate Model Tiers to Model Groups ===
+        model_groups: List[Dict[str, Any]] = []
+        # mg_id -> (tier id parsed back from mg_id, access set, whitelist mode);
+        # the access set is None when every user tier may use the group.
+        model_access: Dict[str, Any] = {}
+        first_by_tier_id: Dict[Any, Dict[str, Any]] = {}
+        for tier in model_tiers:
+            try:
+                first_by_tier_id.setdefault(tier.get("tier_id"), tier)
+            except TypeError:
+                continue  # unhashable tier_id never equals a parsed int
+        for tier in model_tiers:
             tier_id = tier.get("tier_id", 0)
+            mg_id = f"tier_{tier_id}"
             model_groups.append(
                 {
-                    "id": f"tier_{tier_id}",
+                    "id": mg_id,
                     "name": tier.get("tier_name", f"Tier {tier_id}"),
                     "models": tier.get("models", []),
                 }
             )
+            try:
+                mg_tier_id = int(mg_id.split("_")[1]) if "_" in mg_id else 0
+            except (IndexError, ValueError):
+                mg_tier_id = 0
+            mt = first_by_tier_id.get(mg_tier_id)
+            if mt is None:
+                model_access[mg_id] = (mg_tier_id, None, False)
+            else:
+                access_list = mt.get("access_list", [])
+                model_access[mg_id] = (
+                    mg_tier_id,
+                    (
+                        {a for a in access_list if isinstance(a, str)}
+                        if access_list
+                        else None
+                    ),
+                    mt.get("mode_whitelist", False),
+                )
 
         # === Migrate User Tiers to User Groups ===
         user_groups: List[Dict[str, Any]] = []
@@ -269,53 +1107,25 @@ class Filter:
             cfg.get("user_tiers", []) if isinstance(cfg.get("user_tiers"), list) else []
         ):
             tier_id = tier.get("tier_id", 0)
+            user_emails = tier.get("emails", [])
             permissions: Dict[str, Any] = {}
 
             for mg in model_groups:
                 mg_id = mg["id"]
-                try:
-                    mg_tier_id = int(mg_id.split("_")[1]) if "_" in mg_id else 0
-                except (IndexError, ValueError):
-                    mg_tier_id = 0
-
-                if cfg.get("model_tiers_config", {}).get("match_tiers", False):
+                mg_tier_id, access, mode_wl = model_access[mg_id]
+                if match_tiers:
                     enabled = tier_id == mg_tier_id
+                elif access is None:
+                    enabled = True
                 else:
-                    mt = next(
-                        (
-                            t
-                            for t in (
-                                cfg.get("model_tiers", [])
-                                if isinstance(cfg.get("model_tiers"), list)
-                                else []
-                            )
-                            if t.get("tier_id") == mg_tier_id
-                        ),
-                        None,
+                    listed = bool(user_emails) and any(
+                        isinstance(email, str) and email in access
+                        for email in user_emails
                     )
-                    if mt:
-                        access_list = mt.get("access_list", [])
-                        mode_wl = mt.get("mode_whitelist", False)
-                        if not access_list:
-                            enabled = True
-                        elif mode_wl:
-                            user_emails = tier.get("emails", [])
-                            if not user_emails:
-                                enabled = False
-                            else:
-                                enabled = any(
-                                    email in access_list for email in user_emails
-                                )
-                        else:
-                            user_emails = tier.get("emails", [])
-                            if not user_emails:
-                                enabled = True
-                            else:
-                                enabled = not any(
-                                    email in access_list for email in user_emails
-                                )
+                    if mode_wl:
+                        enabled = listed
                     else:
-                        enabled = True
+                        enabled = not listed
 
                 permissions[mg_id] = {
                     "enabled": enabled,
@@ -331,7 +1141,7 @@ class Filter:
                     "id": f"tier_{tier_id}",
                     "name": tier.get("tier_name", f"Tier {tier_id}"),
                     "priority": tier_id,
-                    "emails": tier.get("emails", []),
+                    "emails": user_emails,
                     "default_permissions": {
                         "enabled": False,
                         "rpm": 0,
@@ -344,6 +1154,7 @@ class Filter:
                 }
             )
 
+        self._legacy_migration = (legacy_sections, model_groups, user_groups)
         cfg["model_groups"] = model_groups
         cfg["user_groups"] = user_groups
 
@@ -366,7 +1177,7 @@ class Filter:
             if not isinstance(g, dict):
                 continue
             emails = g.get("emails")
-            if isinstance(emails, list) and len(emails) == 0:
+            if isinstance(emails, list) and len(emails) == 0 and not g.get("files"):
                 catch_alls.append(g)
         if len(catch_alls) > 1:
             self._warned_multiple_default_groups = True
@@ -388,69 +1199,701 @@ class Filter:
                 },
             )
 
+    # ----------------------------
+    # Policy compilation
+    # ----------------------------
+    @staticmethod
+    def _config_error(path: str, problem: str) -> Exception:
+        return Exception(f"Configuration Error: {path} {problem}")
+
+    def _cfg_section(self, cfg: Dict[str, Any], key: str) -> Dict[str, Any]:
+        value = cfg.get(key)
+        if not isinstance(value, dict):
+            raise self._config_error(key, "must be an object")
+        return value
+
+    def _expect_list(self, value: Any, path: str, allow_none: bool = True) -> list:
+        if value is None and allow_none:
+            return []
+        if not isinstance(value, list):
+            raise self._config_error(path, f"must be a list, got {value!r}")
+        return value
+
+    def _expect_number(self, value: Any, path: str) -> float:
+        if value is None:
+            return 0
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise self._config_error(path, f"must be a number, got {value!r}")
+        return value
+
+    def _compile_email_set(self, section: Dict[str, Any], path: str) -> Set[str]:
+        emails = self._expect_list(section.get("emails"), f"{path}.emails")
+        return {e for e in map(self._normalize_email, emails) if e}
+
+    def _compile_files(
+        self, p: _Policy, section: Dict[str, Any], path: str
+    ) -> List[_MembershipFile]:
+        files: List[_MembershipFile] = []
+        for i, value in enumerate(
+            self._expect_list(section.get("files"), f"{path}.files")
+        ):
+            where = f"{path}.files[{i}]"
+            if not isinstance(value, str) or not value.strip():
+                raise self._config_error(where, "must be a file path")
+            file_path = os.path.abspath(os.path.expanduser(value.strip()))
+            f = self._membership_files.get(file_path)
+            if f is None:
+                f = _MembershipFile(file_path)
+                try:
+                    f.load()
+                except (OSError, ValueError) as e:
+                    raise self._config_error(where, f"cannot be read ({e})")
+                self._membership_files[file_path] = f
+            if f not in p.membership_files:
+                p.membership_files.append(f)
+            files.append(f)
+        return files
+
+    def _compile_membership(
+        self, p: _Policy, section: Dict[str, Any], path: str
+    ) -> _MembershipSet:
+        return _MembershipSet(
+            self._compile_email_set(section, path),
+            self._compile_files(p, section, path),
+        )
+
+    def _compile_limits(
+        self, raw: Dict[str, Any], path: str, cls: type = _Limits
+    ) -> _Limits:
+        limits = cls(raw)
+        limits.rpm = self._expect_number(raw.get("rpm", 0), f"{path}.rpm")
+        limits.rph = self._expect_number(raw.get("rph", 0), f"{path}.rph")
+        limits.win_time = self._expect_number(
+            raw.get("win_time", 0), f"{path}.win_time"
+        )
+        limits.win_limit = self._expect_number(
+            raw.get("win_limit", 0), f"{path}.win_limit"
+        )
+        limits.clip = self._coerce_nonneg_int(raw.get("clip", 0))
+        return limits
+
+    def _compile_strings(self, cfg: Dict[str, Any]) -> Dict[str, str]:
+        strings = self._cfg_section(cfg, "custom_strings")
+        formatter = string.Formatter()
+        for key, allowed in _STRING_PLACEHOLDERS.items():
+            template = strings.get(key)
+            path = f"custom_strings.{key}"
+            if not isinstance(template, str):
+                raise self._config_error(path, "must be a string")
+            try:
+                fields = [
+                    f for _, f, _, _ in formatter.parse(template) if f is not None
+                ]
+            except ValueError as e:
+                raise self._config_error(path, f"is not a valid template ({e})")
+            for field in fields:
+                name = field.split(".")[0].split("[")[0]
+                if name not in allowed:
+                    raise self._config_error(
+                        path,
+                        f"uses unknown placeholder {{{field}}} "
+                        f"(allowed: {', '.join(sorted(allowed))})",
+                    )
+        return strings
+
+    # Top-level sections each reusable part of a compiled policy depends on.
+    _IDENTITY_SECTIONS = ("exemption", "auth", "whitelist", "ban_reasons")
+    _MODEL_SECTIONS = ("model_groups",)
+    _USER_SECTIONS = ("model_groups", "user_groups", "custom_strings")
+
+    def _compile_policy(
+        self, cfg: Dict[str, Any], previous: Optional[_Policy] = None
+    ) -> Tuple[_Policy, Set[str]]:
+        """
+        Validate a parsed config once and flatten it into slot objects and
+        hash indexes, so `inlet` only does attribute reads and dict lookups.
+        Invalid input raises "Configuration Error: <path> ...".
+
+        With `previous`, parts whose top-level sections are unchanged are
+        carried over instead of rebuilt; returns (policy, rebuilt parts).
+        """
+        p = _Policy()
+        p.cfg = cfg
+        p.membership_files = []
+        rebuilt: Set[str] = set()
+        prev_cfg = previous.cfg if previous is not None else None
+
+        def unchanged(sections: Tuple[str, ...]) -> bool:
+            return prev_cfg is not None and all(
+                prev_cfg.get(k) == cfg.get(k) for k in sections
+            )
+
+        base = self._cfg_section(cfg, "base")
+        p.enabled = bool(base.get("enabled", True))
+        p.admin_effective = bool(base.get("admin_effective", False))
+
+        if unchanged(("custom_strings",)):
+            p.strings = previous.strings
+        else:
+            p.strings = self._compile_strings(cfg)
+            rebuilt.add("custom_strings")
+
+        if unchanged(self._IDENTITY_SECTIONS):
+            p.exemption = previous.exemption
+            p.auth_domains = previous.auth_domains
+            p.auth_deny_msg = previous.auth_deny_msg
+            p.whitelist = previous.whitelist
+            p.bans = previous.bans
+            p.ban_files = previous.ban_files
+            for members in (p.exemption, p.whitelist):
+                if members is not None:
+                    p.membership_files.extend(members.files)
+            p.membership_files.extend(f for _, f, _ in p.ban_files)
+        else:
+            self._compile_identity(p, cfg)
+            rebuilt.add("identity")
+
+        global_limit = self._cfg_section(cfg, "global_limit")
+        p.global_limit = bool(global_limit.get("enabled", False))
+
+        fallback = self._cfg_section(cfg, "fallback")
+        p.fallback_enabled = bool(fallback.get("enabled", False))
+        model = fallback.get("model")
+        p.fallback_model = model if isinstance(model, str) and model.strip() else None
+        p.fallback_notify = bool(fallback.get("notify", True))
+        p.fallback_notify_msg = fallback.get("notify_msg", "")
+
+        ads = self._cfg_section(cfg, "ads")
+        p.ads = []
+        if ads.get("enabled", False) and ads.get("content"):
+            content = self._expect_list(ads.get("content"), "ads.content")
+            p.ads = [ad for ad in content if isinstance(ad, str) and ad.strip()]
+
+        reporting = self._cfg_section(cfg, "reporting")
+        p.reporting = bool(reporting.get("enabled", False))
+
+        p.state_migration = self._compile_state_migration(cfg)
+
+        p.legacy = not (
+            isinstance(cfg.get("user_groups"), list) and len(cfg["user_groups"]) > 0
+        )
+        grouped = previous is not None and not previous.legacy and not p.legacy
+        p.user_groups = []
+        p.user_index = {}
+        p.user_domains = None
+        p.user_files = []
+        p.default_user_group = None
+        p.model_groups = []
+        p.model_index = {}
+        p.model_patterns = None
+        p.model_cache = {}
+        p.matrix = []
+        if p.legacy:
+            pass
+        elif grouped and unchanged(self._USER_SECTIONS):
+            p.model_groups = previous.model_groups
+            p.model_index = previous.model_index
+            p.model_patterns = previous.model_patterns
+            p.model_cache = previous.model_cache
+            p.user_groups = previous.user_groups
+            p.user_index = previous.user_index
+            p.user_domains = previous.user_domains
+            p.user_files = previous.user_files
+            p.default_user_group = previous.default_user_group
+            p.matrix = previous.matrix
+            for _, _, f in p.user_files:
+                if f not in p.membership_files:
+                    p.membership_files.append(f)
+        else:
+            if grouped and unchanged(self._MODEL_SECTIONS):
+                # Permission rows reference model groups by index, so the
+                # model side can be shared while user groups are rebuilt.
+                p.model_groups = previous.model_groups
+                p.model_index = previous.model_index
+                p.model_patterns = previous.model_patterns
+                p.model_cache = previous.model_cache
+            else:
+                self._compile_model_groups(p, cfg)
+                rebuilt.add("model_groups")
+            self._compile_user_groups(p, cfg)
+            rebuilt.add("user_groups")
+        p.pools = [] if p.legacy else self._compile_pools(p, cfg)
+        p.pool_matrix = None
+        if p.pools:
+            p.pool_matrix = [
+                [
+                    tuple(
+                        pool
+                        for pool in p.pools
+                        if ug.index in pool.user_groups
+                        and (pool.model_groups is None or mg.index in pool.model_groups)
+                    )
+                    for mg in p.model_groups
+                ]
+                for ug in p.user_groups
+            ]
+        p.adaptive = self._compile_adaptive(p, cfg)
+        telemetry = self._cfg_section(cfg, "telemetry")
+        p.telemetry = not p.legacy and bool(telemetry.get("enabled", False))
+        # Recomputed on every compile: shared model groups say nothing about
+        # whether adaptive or telemetry are still enabled.
+        p.track_inflight = (
+            p.adaptive is not None
+            or p.telemetry
+            or any(
+                mg.routing or any(limit for _, _, limit in mg.fallback)
+                for mg in p.model_groups
+            )
+        )
+        p.dedup = self._compile_dedup(p, cfg)
+        return p, rebuilt
+
+    def _compile_pools(self, p: _Policy, cfg: Dict[str, Any]) -> List[_PoolPolicy]:
+        user_ids = {ug.id: ug.index for ug in p.user_groups}
+        model_ids = {mg.id: mg.index for mg in p.model_groups}
+        pools: List[_PoolPolicy] = []
+        seen: Set[str] = set()
+        for i, raw in enumerate(self._expect_list(cfg.get("pools"), "pools")):
+            path = f"pools[{i}]"
+            if not isinstance(raw, dict):
+                raise self._config_error(path, "must be an object")
+            pool = _PoolPolicy()
+            pool.id = raw.get("id")
+            if not isinstance(pool.id, str) or not pool.id:
+                raise self._config_error(f"{path}.id", "must be a non-empty string")
+            if pool.id in seen:
+                raise self._config_error(f"{path}.id", "is a duplicate pool id")
+            seen.add(pool.id)
+            pool.name = raw.get("name", pool.id)
+            pool.limits = self._compile_limits(raw, path)
+            if "daily" in raw:
+                if pool.limits.win_time:
+                    raise self._config_error(
+                        f"{path}.daily", "cannot be combined with win_time"
+                    )
+                pool.limits.win_time = 1440
+                pool.limits.win_limit = self._expect_number(
+                    raw["daily"], f"{path}.daily"
+                )
+            pool.user_groups = set()
+            for j, ug_id in enumerate(
+                self._expect_list(raw.get("user_groups"), f"{path}.user_groups")
+            ):
+                if ug_id not in user_ids:
+                    raise self._config_error(
+                        f"{path}.user_groups[{j}]",
+                        f"must be a user group id, got {ug_id!r}",
+                    )
+                pool.user_groups.add(user_ids[ug_id])
+            pool.model_groups = None
+            if raw.get("model_groups") is not None:
+                pool.model_groups = set()
+                for j, mg_id in enumerate(
+                    self._expect_list(raw["model_groups"], f"{path}.model_groups")
+                ):
+                    if mg_id not in model_ids:
+                        raise self._config_error(
+                            f"{path}.model_groups[{j}]",
+                            f"must be a model group id, got {mg_id!r}",
+                        )
+                    pool.model_groups.add(model_ids[mg_id])
+            pools.append(pool)
+        return pools
+
+    def _compile_dedup(self, p: _Policy, cfg: Dict[str, Any]) -> Optional[_DedupConfig]:
+        section = self._cfg_section(cfg, "dedup")
+        if p.legacy or not section.get("enabled", False):
+            return None
+        d = _DedupConfig()
+        d.window = self._expect_number(section.get("window", 2), "dedup.window")
+        if d.window <= 0:
+            raise self._config_error("dedup.window", "must be > 0")
+        d.messages = section.get("messages", 2)
+        if not isinstance(d.messages, int) or d.messages < 1:
+            raise self._config_error("dedup.messages", "must be an integer >= 1")
+        d.action = section.get("action", "reject")
+        if d.action not in ("reject", "notify"):
+            raise self._config_error("dedup.action", 'must be "reject" or "notify"')
+        d.max_entries = section.get("max_entries", 10000)
+        if not isinstance(d.max_entries, int) or d.max_entries < 1:
+            raise self._config_error("dedup.max_entries", "must be an integer >= 1")
+        return d
+
+    def _compile_adaptive(
+        self, p: _Policy, cfg: Dict[str, Any]
+    ) -> Optional[_AdaptiveConfig]:
+        section = self._cfg_section(cfg, "adaptive")
+        if p.legacy or not section.get("enabled", False):
+            return None
+        a = _AdaptiveConfig()
+        a.target_latency = self._expect_number(
+            section.get("target_latency", 30), "adaptive.target_latency"
+        )
+        a.min_factor = self._expect_number(
+            section.get("min_factor", 0.2), "adaptive.min_factor"
+        )
+        a.decrease = self._expect_number(
+            section.get("decrease", 0.5), "adaptive.decrease"
+        )
+        a.increase = self._expect_number(
+            section.get("increase", 0.1), "adaptive.increase"
+        )
+        a.interval = self._expect_number(
+            section.get("interval", 10), "adaptive.interval"
+        )
+        if a.target_latency <= 0:
+            raise self._config_error("adaptive.target_latency", "must be > 0")
+        if not 0 < a.min_factor <= 1:
+            raise self._config_error("adaptive.min_factor", "must be in (0, 1]")
+        if not 0 < a.decrease < 1:
+            raise self._config_error("adaptive.decrease", "must be in (0, 1)")
+        a.targets = {}
+        for mg in p.model_groups:
+            target = mg.raw.get("target_latency")
+            if target is not None:
+                a.targets[mg.id] = self._expect_number(
+                    target, f"model_groups[{mg.index}].target_latency"
+                )
+        # Shed from the lowest-ranked user group up (reverse match order).
+        a.order = [
+            ug.id for ug in sorted(p.user_groups, key=lambda g: g.rank, reverse=True)
+        ]
+        return a
+
+    def _compile_identity(self, p: _Policy, cfg: Dict[str, Any]) -> None:
+        exemption = self._cfg_section(cfg, "exemption")
+        p.exemption = (
+            self._compile_membership(p, exemption, "exemption")
+            if exemption.get("enabled", False)
+            else None
+        )
+
+        auth = self._cfg_section(cfg, "auth")
+        p.auth_domains = None
+        p.auth_deny_msg = auth.get("deny_msg", "Access Denied")
+        if auth.get("enabled", False):
+            providers = self._expect_list(
+                auth.get("providers"), "auth.providers", allow_none=False
+            )
+            p.auth_domains = {str(x).strip().casefold() for x in providers}
+
+        whitelist = self._cfg_section(cfg, "whitelist")
+        p.whitelist = (
+            self._compile_membership(p, whitelist, "whitelist")
+            if whitelist.get("enabled", False)
+            else None
+        )
+
+        # First matching ban reason wins: email -> (reason index, msg).
+        p.bans = {}
+        p.ban_files = []
+        for i, reason in enumerate(
+            self._expect_list(cfg.get("ban_reasons"), "ban_reasons")
+        ):
+            if not isinstance(reason, dict):
+                raise self._config_error(f"ban_reasons[{i}]", "must be an object")
+            msg = reason.get("msg", "Account Suspended")
+            for email in self._compile_email_set(reason, f"ban_reasons[{i}]"):
+                p.bans.setdefault(email, (i, msg))
+            for f in self._compile_files(p, reason, f"ban_reasons[{i}]"):
+                p.ban_files.append((i, f, msg))
+
+    def _compile_state_migration(self, cfg: Dict[str, Any]) -> Dict[str, List[str]]:
+        """
+        `state_migration` maps an old rate-limit history key (a model group
+        id) to the id, or list of ids, that should inherit its counters.
+        """
+        raw = cfg.get("state_migration")
+        if raw is None:
+            return {}
+        if not isinstance(raw, dict):
+            raise self._config_error("state_migration", "must be an object")
+        mapping: Dict[str, List[str]] = {}
+        for old, new in raw.items():
+            path = f"state_migration.{old}"
+            targets = [new] if isinstance(new, str) else new
+            if not isinstance(targets, list) or not all(
+                isinstance(t, str) and t for t in targets
+            ):
+                raise self._config_error(path, "must be a group id or a list of ids")
+            mapping[old] = list(dict.fromkeys(targets))
+        return mapping
+
+    @staticmethod
+    def _is_model_pattern(entry: str) -> bool:
+        """
+        Pattern entries in `model_groups[].models`:
+        - globs with `*` / `?`, e.g. "openai/gpt-4*", "*:70b"
+        - "re:<regex>", e.g. "re:(llama|qwen)[0-9.]+:70b"
+        Patterns are case-insensitive and must match the whole incoming id
+        (or one of its `_model_id_variants`).
+        """
+        return entry.startswith("re:") or "*" in entry or "?" in entry
+
+    def _compile_model_pattern(
+        self, index: _ModelPatternIndex, group_index: int, entry: str, path: str
+    ) -> None:
+        if entry.startswith("re:"):
+            source, prefix, suffix = entry[3:], "", ""
+            try:
+                index.compiled[source] = re.compile(source, re.IGNORECASE)
+            except re.error as e:
+                raise self._config_error(path, f"is not a valid pattern ({e})")
+        else:
+            source = "".join(
+                ".*" if ch == "*" else "." if ch == "?" else re.escape(ch)
+                for ch in entry
+            )
+            folded = entry.casefold()
+            cut = min(i for i in (folded.find("*"), folded.find("?")) if i >= 0)
+            prefix = folded[:cut]
+            suffix = re.split(r"[*?]", folded)[-1]
+        index.add(group_index, source, prefix, suffix)
+
+    def _compile_model_groups(self, p: _Policy, cfg: Dict[str, Any]) -> None:
+        groups = self._expect_list(cfg.get("model_groups"), "model_groups")
+        seen: Set[str] = set()
+        patterns = _ModelPatternIndex()
+        has_patterns = False
+        for i, raw in enumerate(groups):
+            path = f"model_groups[{i}]"
+            if not isinstance(raw, dict):
+                raise self._config_error(path, "must be an object")
+            mg_id = raw.get("id")
+            if not isinstance(mg_id, str) or not mg_id:
+                raise self._config_error(f"{path}.id", "must be a non-empty string")
+            if mg_id in seen:
+                raise self._config_error(f"{path}.id", f"duplicates '{mg_id}'")
+            seen.add(mg_id)
+
+            mg = _ModelGroupPolicy()
+            mg.index = i
+            mg.id = mg_id
+            mg.name = raw.get("name")
+            mg.label = raw.get("name", mg_id)
+            mg.raw = raw
+            p.model_groups.append(mg)
+
+            # variant -> first group that lists it (first match wins)
+            models = self._expect_list(raw.get("models"), f"{path}.models")
+            for j, configured in enumerate(models):
+                configured_id = self._normalize_model_id(configured)
+                if not configured_id:
+                    continue
+                entry = configured_id.strip()
+                if self._is_model_pattern(entry):
+                    self._compile_model_pattern(
+                        patterns, i, entry, f"{path}.models[{j}]"
+                    )
+                    has_patterns = True
+                    continue
+                for variant in self._model_id_variants(configured_id):
+                    p.model_index.setdefault(variant, i)
+
+        if has_patterns:
+            patterns.finalize()
+            p.model_patterns = patterns
+
+        for mg in p.model_groups:
+            mg.fallback = self._compile_fallback_chain(p, mg)
+            self._compile_routing(mg)
+
+    _ROUTING_MODES = ("least_inflight", "least_latency")
+
+    def _compile_routing(self, mg: _ModelGroupPolicy) -> None:
+        """
+        `model_groups[].routing` treats the group's exact model ids as
+        replicas of one model and sends each request to the replica with the
+        fewest in-flight requests or the lowest recent latency.
+        """
+        mode = mg.raw.get("routing")
+        mg.routing = None
+        mg.replicas = []
+        if mode is None or mode is False:
+            return
+        if mode not in self._ROUTING_MODES:
+            raise self._config_error(
+                f"model_groups[{mg.index}].routing",
+                f"must be one of {', '.join(self._ROUTING_MODES)}",
+            )
+        for configured in mg.raw.get("models") or []:
+            model = self._normalize_model_id(configured).strip()
+            if model and not self._is_model_pattern(model):
+                if model not in mg.replicas:
+                    mg.replicas.append(model)
+        if len(mg.replicas) > 1:
+            mg.routing = mode
+
+    def _compile_fallback_chain(
+        self, p: _Policy, mg: _ModelGroupPolicy
+    ) -> List[Tuple[str, Optional[_ModelGroupPolicy], int]]:
+        """
+        `model_groups[].fallback`: ordered targets tried when a user is over
+        this group's limits, each a model id or
+        {"model": id, "max_inflight": n} (0 = no in-flight cap).
+        """
+        path = f"model_groups[{mg.index}].fallback"
+        chain: List[Tuple[str, Optional[_ModelGroupPolicy], int]] = []
+        for j, entry in enumerate(self._expect_list(mg.raw.get("fallback"), path)):
+            where = f"{path}[{j}]"
+            if isinstance(entry, str):
+                entry = {"model": entry}
+            if not isinstance(entry, dict):
+                raise self._config_error(where, "must be a model id or an object")
+            model = self._normalize_model_id(entry.get("model")).strip()
+            if not model:
+                raise self._config_error(f"{where}.model", "must be a model id")
+            limit = self._expect_number(
+                entry.get("max_inflight", 0), f"{where}.max_inflight"
+            )
+            chain.append((model, self._get_model_group(p, model), int(limit)))
+        return chain
+
+    def _compile_user_groups(self, p: _Policy, cfg: Dict[str, Any]) -> None:
+        groups = cfg["user_groups"]
+        group_files: List[List[_MembershipFile]] = []
+        for i, raw in enumerate(groups):
+            path = f"user_groups[{i}]"
+            if not isinstance(raw, dict):
+                raise self._config_error(path, "must be an object")
+            ug = _UserGroupPolicy()
+            ug.index = i
+            ug.id = raw.get("id")
+            ug.name = raw.get("name")
+            ug.label = raw.get("name", raw.get("id"))
+            ug.priority = self._expect_number(
+                raw.get("priority", 0), f"{path}.priority"
+            )
+            ug.raw = raw
+            p.user_groups.append(ug)
+
+            emails = self._expect_list(raw.get("emails", []), f"{path}.emails")
+            files = self._compile_files(p, raw, path)
+            group_files.append(files)
+            if len(emails) == 0 and not files and p.default_user_group is None:
+                p.default_user_group = ug
+
+            for key in ("permissions", "default_permissions"):
+                value = raw.get(key)
+                if value is not None and not isinstance(value, dict):
+                    raise self._config_error(f"{path}.{key}", "must be an object")
+            for mg_id, value in (raw.get("permissions") or {}).items():
+                if value is not None and not isinstance(value, dict):
+                    raise self._config_error(
+                        f"{path}.permissions.{mg_id}", "must be an object"
+                    )
+
+            p.matrix.append(self._compile_permission_row(p, ug, path))
+
+        if p.default_user_group is None:
+            p.default_user_group = p.user_groups[0]
+
+        # Highest priority wins; sort is stable so config order breaks ties.
+        ranked = sorted(p.user_groups, key=lambda g: g.priority, reverse=True)
+        for rank, ug in enumerate(ranked):
+            ug.rank = rank
+            for f in group_files[ug.index]:
+                p.user_files.append((rank, ug.index, f))
+            for j, email in enumerate(ug.raw.get("emails") or []):
+                email = self._normalize_email(email)
+                if not email.startswith("*@"):
+                    p.user_index.setdefault(email, ug.index)
+                    continue
+                domain = email[2:]
+                subdomains = domain.startswith("*.")
+                if subdomains:
+                    domain = domain[2:]
+                if not domain or "*" in domain or "@" in domain:
+                    raise self._config_error(
+                        f"user_groups[{ug.index}].emails[{j}]",
+                        "must be an email, '*@domain' or '*@*.domain'",
+                    )
+                if p.user_domains is None:
+                    p.user_domains = _DomainTrie()
+                p.user_domains.insert(domain, subdomains, rank, ug.index)
+
+    def _compile_permission_row(
+        self, p: _Policy, ug: _UserGroupPolicy, path: str
+    ) -> List[_Permission]:
+        row: List[_Permission] = []
+        for mg in [None] + p.model_groups:
+            perms, source = self._get_effective_group_permissions(
+                ug.raw, mg.raw if mg else None
+            )
+            perm_path = f"{path}.{source}" if source != "none" else path
+            perm = self._compile_limits(perms, perm_path, _Permission)
+            perm.source = source
+            perm.clip_bytes = self._coerce_nonneg_int(perms.get("clip_bytes", 0))
+            perm.strip_attachments = self._coerce_nonneg_int(
+                perms.get("strip_attachments", 0)
+            )
+            perm.enabled = bool(perms.get("enabled", False))
+            perm.denied = mg is not None and bool(perms) and not perm.enabled
+            perm.deny_msg = None
+            perm.source_name = None
+            if mg is not None:
+                perm.source_name = f"{ug.name} → {mg.name}"
+                if perm.denied:
+                    perm.deny_msg = p.strings["group_no_permission"].format(
+                        u_group=ug.label, m_group=mg.label
+                    )
+            row.append(perm)
+        return row
+
     # ----------------------------
     # Group matching
     # ----------------------------
-    def _get_user_group(self, cfg: Dict[str, Any], email: str) -> Dict[str, Any]:
+    def _get_user_group(self, policy: _Policy, email: str) -> _UserGroupPolicy:
         """
         Find the user group for a given email.
-        Returns the group with highest priority that contains this email.
+        Returns the group with highest priority that lists this email.
+        Explicit emails take precedence over domain rules ("*@corp.com",
+        "*@*.corp.com"), which are then resolved by priority as well.
         If no match, returns the default group (emails=[]).
         """
-        groups = cfg.get("user_groups", [])
-        if not isinstance(groups, list) or not groups:
-            raise Exception("Configuration Error: No user groups defined.")
-        email_norm = self._normalize_email(email)
-        sorted_groups = sorted(
-            groups,
-            key=lambda g: (g.get("priority", 0) if isinstance(g, dict) else 0),
-            reverse=True,
-        )
-        for group in sorted_groups:
-            if not isinstance(group, dict):
-                continue
-            group_emails = group.get("emails", [])
-            if not isinstance(group_emails, list) or not group_emails:
-                continue
-            if any(self._normalize_email(e) == email_norm for e in group_emails):
-                return group
-        for group in groups:
-            if not isinstance(group, dict):
-                continue
-            emails = group.get("emails", [])
-            if isinstance(emails, list) and len(emails) == 0:
-                return group
-        return (
-            groups[0]
-            if isinstance(groups[0], dict)
-            else {"id": "unknown", "name": "unknown"}
-        )
+        email = self._normalize_email(email)
+        idx = policy.user_index.get(email)
+        # Emails listed in `files` count as explicit entries of their group.
+        for rank, group_idx, f in policy.user_files:
+            if idx is not None and rank >= policy.user_groups[idx].rank:
+                break
+            if email in f.entries:
+                idx = group_idx
+                break
+        if idx is not None:
+            return policy.user_groups[idx]
+        if policy.user_domains is not None and "@" in email:
+            idx = policy.user_domains.lookup(email.rsplit("@", 1)[1])
+            if idx is not None:
+                return policy.user_groups[idx]
+        return policy.default_user_group
 
     def _get_model_group(
-        self, cfg: Dict[str, Any], model_id: Any
-    ) -> Optional[Dict[str, Any]]:
+        self, policy: _Policy, model_id: Any
+    ) -> Optional[_ModelGroupPolicy]:
         """
         Find the model group for a given model ID.
         Returns None if model is not in any group.
         """
-        groups = cfg.get("model_groups", [])
-        if not isinstance(groups, list):
-            return None
-        incoming = self._normalize_model_id(model_id)
-        incoming_variants = self._model_id_variants(incoming)
-        for group in groups:
-            if not isinstance(group, dict):
-                continue
-            models = group.get("models", [])
-            if not isinstance(models, list):
-                continue
-            for configured in models:
-                configured_id = self._normalize_model_id(configured)
-                if not configured_id:
-                    continue
-                if self._model_id_variants(configured_id) & incoming_variants:
-                    return group
-        return None
+        model_id = self._normalize_model_id(model_id)
+        cache = policy.model_cache
+        best: Optional[int]
+        if model_id in cache:
+            best = cache[model_id]
+        else:
+            index = policy.model_index
+            variants = self._model_id_variants(model_id)
+            best = None
+            for variant in variants:
+                idx = index.get(variant)
+                if idx is not None and (best is None or idx < best):
+                    best = idx
+            if policy.model_patterns is not None:
+                best = policy.model_patterns.match(variants, best)
+            if len(cache) >= self._MODEL_CACHE_MAX:
+                cache.clear()
+            cache[model_id] = best
+        return policy.model_groups[best] if best is not None else None
 
     @staticmethod
     def _normalize_model_id(model_field: Any) -> str:
@@ -522,40 +1965,10 @@ class Filter:
             return True
 
         candidates: List[Tuple[List[dict], str]] = []
-
-        def add_candidate(value: Any, source: str) -> None:
+        for path in _MESSAGE_SOURCES:
+            value = Filter._messages_at(body, path)
             if is_valid_messages(value):
-                candidates.append((value, source))
-
-        keys = (
-            "messages",
-            "history",
-            "chat_history",
-            "conversation_messages",
-            "all_messages",
-        )
-        for key in keys:
-            add_candidate(body.get(key), f"body.{key}")
-
-        meta = body.get("metadata")
-        if isinstance(meta, dict):
-            for key in keys:
-                add_candidate(meta.get(key), f"body.metadata.{key}")
-
-        chat = body.get("chat")
-        if isinstance(chat, dict):
-            add_candidate(chat.get("messages"), "body.chat.messages")
-
-        conversation = body.get("conversation")
-        if isinstance(conversation, dict):
-            for key in keys:
-                add_candidate(conversation.get(key), f"body.conversation.{key}")
-            add_candidate(conversation.get("messages"), "body.conversation.messages")
-
-        data = body.get("data")
-        if isinstance(data, dict):
-            for key in keys:
-                add_candidate(data.get(key), f"body.data.{key}")
+                candidates.append((value, "body." + ".".join(path)))
 
         if not candidates:
             return [], "none"
@@ -563,6 +1976,15 @@ class Filter:
         messages, source = max(candidates, key=lambda item: len(item[0]))
         return messages, source
 
+    @staticmethod
+    def _messages_at(body: dict, path: Tuple[str, ...]) -> Any:
+        value: Any = body
+        for key in path:
+            if not isinstance(value, dict):
+                return None
+            value = value.get(key)
+        return value
+
     @staticmethod
     def _select_messages(body: dict) -> List[dict]:
         return Filter._select_messages_with_source(body)[0]
@@ -583,9 +2005,23 @@ class Filter:
         Retrieve and parse the configuration from valves.
         Auto-migrates old tier configs to new group system.
         Supports JSONC comments (//, /* */ and #).
+        The parsed result is cached until `config_json` changes; callers must
+        treat it as read-only.
+        """
+        return self._get_policy().cfg
+
+    def _get_policy(self) -> _Policy:
+        """
+        Return the compiled policy for the current `config_json`,
+        re-parsing and re-compiling only when the raw string changes.
         """
+        raw = self.valves.config_json
+        if self._policy is not None and raw == self._cfg_raw:
+            if self._membership_files:
+                self._poll_membership_files()
+            return self._policy
         try:
-            raw = self.valves.config_json
+            source = raw
             raw = raw.lstrip("\ufeff") if isinstance(raw, str) else raw
 
             try:
@@ -599,9 +2035,203 @@ class Filter:
             cfg = self._merge_dict_defaults(cfg, DEFAULT_CONFIG)
             cfg = self._migrate_config_to_groups(cfg)
             self._warn_if_multiple_default_user_groups(cfg)
-            return cfg
         except Exception as e:
             raise Exception(f"Configuration Parse Error: {str(e)}")
+        policy, rebuilt = self._compile_policy(cfg, self._policy)
+        if self._policy is not None:
+            self._log(cfg, "OAG", "Config Reload", {"rebuilt": sorted(rebuilt)})
+        self._cfg_raw = source
+        self._policy = policy
+        # Memoized decisions only depend on the identity, group and string
+        # parts; they survive edits to ads, fallback, logging and the like.
+        if rebuilt:
+            self._static_cache.clear()
+        self._register_state_migration(policy.state_migration)
+        self._blocked.clear()
+        for state in self._adaptive.values():
+            state.scaled.clear()
+        if not policy.track_inflight:
+            # Nothing would start or expire entries any more.
+            self._inflight = _InflightTracker()
+        if not policy.reporting:
+            self._usage = None
+        elif self._usage is None:
+            if np is None:
+                self._log(cfg, "OAG", "Reporting Disabled", "numpy is not installed")
+            else:
+                self._usage = _UsageLog()
+        self._membership_files = {f.path: f for f in policy.membership_files}
+        self._membership_version = sum(
+            f.version for f in self._membership_files.values()
+        )
+        return policy
+
+    def _register_state_migration(self, mapping: Dict[str, List[str]]) -> None:
+        """
+        Queue `state_migration` entries that have not been seen before. They
+        are applied per user on that user's next history access (see
+        `_history`), so a config push never walks every user at once.
+        """
+        for old, targets in mapping.items():
+            entry = (old, tuple(targets))
+            if entry in self._migrations_seen:
+                continue
+            self._migrations_seen.add(entry)
+            self._migrations.append(entry)
+
+    def _history(self, user_id: str, key: str) -> List[float]:
+        """
+        Hit timestamps of `user_id` for one history key ("GLOBAL", a model
+        group id, "ungrouped" or a legacy model id), created on first use.
+        Pending `state_migration` entries are applied here first.
+        """
+        user_hist = self.user_history.get(user_id)
+        if user_hist is None:
+            user_hist = self.user_history[user_id] = {}
+            if self._migrations:
+                self._migrated_upto[user_id] = len(self._migrations)
+            if self._generation:
+                self._reset_seen[user_id] = self._generation
+        else:
+            self._migrate_user_history(user_id, user_hist)
+        history = user_hist.get(key)
+        if history is None:
+            history = user_hist[key] = []
+        return history
+
+    def _peek_history(self, user_id: str, key: str) -> List[float]:
+        """Like `_history`, but never creates entries for unknown users/keys."""
+        user_hist = self.user_history.get(user_id)
+        if user_hist is None:
+            return []
+        self._migrate_user_history(user_id, user_hist)
+        return user_hist.get(key) or []
+
+    def _apply_resets(self, user_id: str, user_group: _UserGroupPolicy) -> None:
+        """
+        Clear the histories of `user_id` that a `reset_quotas` call made
+        since their last check covers; O(1) when nothing was reset.
+        """
+        seen = self._reset_seen.get(user_id, 0)
+        if seen == self._generation:
+            return
+        self._reset_seen[user_id] = self._generation
+        user_hist = self.user_history.get(user_id)
+        if not user_hist:
+            return
+        whole = max(
+            self._reset_all,
+            self._reset_users.get(user_id, 0),
+            self._reset_user_groups.get(user_group.id, 0),
+        )
+        for key, history in user_hist.items():
+            if history and max(whole, self._reset_keys.get(key, 0)) > seen:
+                history.clear()
+                self._blocked.pop((user_id, key), None)
+
+    def reset_quotas(
+        self,
+        user: Optional[str] = None,
+        user_group: Optional[str] = None,
+        model_group: Optional[str] = None,
+    ) -> int:
+        """
+        Reset rate-limit counters of one user id, one user group id, one
+        history key (a model group id, "GLOBAL" or "ungrouped"), or, with no
+        argument, everyone. Only a generation number is bumped; affected
+        histories are cleared lazily the next time their user sends a
+        request. Returns the new generation.
+
+        Shared `pools` are cleared right away when the user group or model
+        group scope draws from them ("GLOBAL": every pool). A single-user
+        reset leaves pools alone, as a pool's hits are not kept per user.
+        """
+        if sum(scope is not None for scope in (user, user_group, model_group)) > 1:
+            raise Exception("reset_quotas takes at most one scope")
+        self._generation += 1
+        gen = self._generation
+        if user is not None:
+            self._reset_users[user] = gen
+        elif user_group is not None:
+            self._reset_user_groups[user_group] = gen
+            policy = self._get_policy()
+            for ug in policy.user_groups:
+                if ug.id == user_group:
+                    self._reset_pools(
+                        [p for p in policy.pools if ug.index in p.user_groups]
+                    )
+        elif model_group is not None:
+            self._reset_keys[model_group] = gen
+            policy = self._get_policy()
+            if model_group == "GLOBAL":
+                self._reset_pools(policy.pools)
+            for mg in policy.model_groups:
+                if mg.id == model_group:
+                    self._reset_pools(
+                        [
+                            p
+                            for p in policy.pools
+                            if p.model_groups is None or mg.index in p.model_groups
+                        ]
+                    )
+        else:
+            self._reset_all = gen
+            self._reset_users.clear()
+            self._reset_user_groups.clear()
+            self._reset_keys.clear()
+            self._pool_history = {}
+            self._blocked.clear()
+        return gen
+
+    def _reset_pools(self, pools: List[_PoolPolicy]) -> None:
+        """
+        Clear shared pools now; blocked entries are dropped too, as members
+        of other user groups may have been rejected for these pools.
+        """
+        for pool in pools:
+            self._pool_history.pop(pool.id, None)
+        if pools:
+            self._blocked.clear()
+
+    def _migrate_user_history(
+        self, user_id: str, user_hist: Dict[str, List[float]]
+    ) -> None:
+        if self._migrations:
+            done = self._migrated_upto.get(user_id, 0)
+            if done < len(self._migrations):
+                self._apply_state_migration(user_hist, done)
+                self._migrated_upto[user_id] = len(self._migrations)
+
+    def _apply_state_migration(
+        self, user_hist: Dict[str, List[float]], start: int
+    ) -> None:
+        # Entries run in registration order, so chained renames (a -> b,
+        # later b -> c) carry counters all the way through.
+        for old, targets in self._migrations[start:]:
+            moved = user_hist.pop(old, None)
+            if not moved:
+                continue
+            for target in targets:
+                existing = user_hist.get(target)
+                user_hist[target] = sorted(existing + moved) if existing else moved[:]
+
+    def _poll_membership_files(self) -> None:
+        """
+        Check external membership files for mtime changes (at most every
+        `_MEMBERSHIP_POLL_INTERVAL` seconds) and drop memoized decisions once
+        a background re-index has been swapped in.
+        """
+        now = time.monotonic()
+        if now < self._membership_next_poll:
+            return
+        self._membership_next_poll = now + self._MEMBERSHIP_POLL_INTERVAL
+        version = 0
+        for f in self._membership_files.values():
+            f.poll()
+            version += f.version
+        if version != self._membership_version:
+            self._membership_version = version
+            self._static_cache.clear()
 
     def _log(self, cfg: Dict[str, Any], level: str, msg: str, data: Any = None) -> None:
         """
@@ -695,31 +2325,55 @@ class Filter:
 
         return 0
 
+    def _probe_limits(self, limits: _Limits, history: List[float]) -> _QuotaProbe:
+        """
+        Count hits per window with a binary search over the time-sorted
+        history (O(log n)); nothing is modified. A window frees its next slot
+        when the oldest hit that keeps it at the limit ages out.
+        """
+        now = self._now()
+        probe = _QuotaProbe()
+        size = len(history)
+        for key, label, limit, span in (
+            ("rpm", "RPM", limits.rpm, 60),
+            ("rph", "RPH", limits.rph, 3600),
+            ("window", "Window", limits.win_limit, limits.win_time * 60),
+        ):
+            if limit <= 0 or span <= 0:
+                continue
+            first = bisect.bisect_right(history, now - span)
+            used = size - first
+            probe.remaining[key] = max(0, math.ceil(limit - used))
+            if used >= limit:
+                if probe.exhausted is None:
+                    probe.exhausted = label
+                frees_at = history[first + int(used - limit)] + span
+                probe.frees_at.append((label, frees_at))
+                probe.retry_after = max(probe.retry_after, frees_at - now)
+        return probe
+
     def _check_specific_limit(
-        self, source_name: str, limits: Dict[str, Any], history: List[float]
-    ) -> Tuple[bool, Optional[str]]:
-        now = time.time()
-        rpm = limits.get("rpm", 0)
-        rph = limits.get("rph", 0)
-        w_lim = limits.get("win_limit", 0)
-        w_time = limits.get("win_time", 0)
-
-        if rpm > 0:
-            count = len([t for t in history if now - t < 60])
-            if count >= rpm:
-                return True, f"{source_name} RPM Limit"
-
-        if rph > 0:
-            count = len([t for t in history if now - t < 3600])
-            if count >= rph:
-                return True, f"{source_name} RPH Limit"
-
-        if w_lim > 0 and w_time > 0:
-            count = len([t for t in history if now - t < w_time * 60])
-            if count >= w_lim:
-                return True, f"{source_name} Window Limit"
-
-        return False, None
+        self, source_name: str, limits: _Limits, history: List[float]
+    ) -> Tuple[bool, Optional[str], float]:
+        """Returns (limited, reason, seconds until a request would pass)."""
+        probe = self._probe_limits(limits, history)
+        if probe.exhausted is None:
+            return False, None, 0.0
+        return True, f"{source_name} {probe.exhausted} Limit", probe.retry_after
+
+    def _trim_history(self, history: List[float]) -> List[float]:
+        """Drop hits older than a day, in place (history is time-sorted)."""
+        cut = bisect.bisect_right(history, self._now() - 86400)
+        if cut:
+            del history[:cut]
+        return history
+
+    def _record_hit(self, user_id: str, key: str, now: float) -> None:
+        # insort keeps the history sorted even if the clock steps backwards;
+        # for in-order hits it is a plain append.
+        bisect.insort(self._history(user_id, key), now)
+        if self._blocked:
+            self._blocked.pop((user_id, key), None)
 
     def _check_rate_limit(
         self,
@@ -729,27 +2383,24 @@ class Filter:
         model_id: str,
         user_tier_idx: int,
         model_tier_idx: int,
-    ) -> Tuple[bool, Optional[str]]:
-        now = time.time()
+    ) -> Tuple[bool, Optional[str], float]:
         ut_cfg = cfg["user_tiers"][user_tier_idx]
         mt_cfg = cfg["model_tiers"][model_tier_idx]
 
-        if user_id not in self.user_history:
-            self.user_history[user_id] = {}
-
         target_history_key = (
             "GLOBAL" if cfg.get("global_limit", {}).get("enabled", False) else model_id
         )
-        if target_history_key not in self.user_history[user_id]:
-            self.user_history[user_id][target_history_key] = []
+        history = self._trim_history(self._history(user_id, target_history_key))
 
-        history = self.user_history[user_id][target_history_key]
-        history = [t for t in history if now - t < 86400]
-        self.user_history[user_id][target_history_key] = history
-
-        user_hit, user_reason = self._check_specific_limit("User Tier", ut_cfg, history)
-        model_hit, model_reason = self._check_specific_limit(
-            "Model Tier", mt_cfg, history
+        user_hit, user_reason, user_retry = self._check_specific_limit(
+            "User Tier",
+            self._compile_limits(ut_cfg, f"user_tiers[{user_tier_idx}]"),
+            history,
+        )
+        model_hit, model_reason, model_retry = self._check_specific_limit(
+            "Model Tier",
+            self._compile_limits(mt_cfg, f"model_tiers[{model_tier_idx}]"),
+            history,
         )
 
         global_prio = cfg.get("priority", {}).get("user_priority", False)
@@ -758,17 +2409,17 @@ class Filter:
 
         if use_user_priority:
             if user_hit:
-                return True, user_reason
+                return True, user_reason, user_retry
             if model_hit:
-                return False, None
-            return False, None
+                return False, None, 0.0
+            return False, None, 0.0
 
         if user_hit:
-            return True, user_reason
+            return True, user_reason, user_retry
         if model_hit:
-            return True, model_reason
+            return True, model_reason, model_retry
 
-        return False, None
+        return False, None, 0.0
 
     # ----------------------------
     # Group System
@@ -795,95 +2446,161 @@ class Filter:
 
     def _check_rate_limit_group(
         self,
-        cfg: Dict[str, Any],
+        policy: _Policy,
         user_id: str,
-        user_group: Dict[str, Any],
-        model_group: Optional[Dict[str, Any]],
-        model_perms: Dict[str, Any],
-    ) -> Tuple[bool, Optional[str]]:
+        model_group: Optional[_ModelGroupPolicy],
+        perm: _Permission,
+        user_group: Optional[_UserGroupPolicy] = None,
+    ) -> Tuple[bool, Optional[str], float]:
         """
-        Check rate limits using new Group system.
+        Check rate limits using new Group system: the user's own limits first,
+        then every pool the request draws from.
         """
         if not model_group:
-            return False, None
-
-        model_group_id = model_group.get("id")
-        if not isinstance(model_group_id, str) or not model_group_id:
-            return False, None
-
-        if model_perms and not model_perms.get("enabled", False):
-            user_group_name = user_group.get("name", user_group.get("id"))
-            model_group_name = model_group.get("name", model_group.get("id"))
-            msg = cfg.get("custom_strings", {}).get(
-                "group_no_permission",
-                "Access Denied: User group '{u_group}' cannot access model group '{m_group}'",
-            )
-            raise Exception(
-                msg.format(u_group=user_group_name, m_group=model_group_name)
-            )
-
-        now = time.time()
-        if user_id not in self.user_history:
-            self.user_history[user_id] = {}
-
-        target_history_key = (
-            "GLOBAL"
-            if cfg.get("global_limit", {}).get("enabled", False)
-            else model_group_id
-        )
-        if target_history_key not in self.user_history[user_id]:
-            self.user_history[user_id][target_history_key] = []
+            return False, None, 0.0
+
+        if perm.denied:
+            raise Exception(perm.deny_msg)
+
+        target_history_key = "GLOBAL" if policy.global_limit else model_group.id
+        history = self._trim_history(self._history(user_id, target_history_key))
+
+        limited = self._check_specific_limit(perm.source_name, perm, history)
+        if limited[0] or policy.pool_matrix is None or user_group is None:
+            return limited
+        for pool in policy.pool_matrix[user_group.index][model_group.index]:
+            history = self._pool_history.get(pool.id)
+            if history:
+                self._trim_history(history)
+                limited = self._check_specific_limit(
+                    f"Pool {pool.name}", pool.limits, history
+                )
+                if limited[0]:
+                    return limited
+        return False, None, 0.0
 
-        history = self.user_history[user_id][target_history_key]
-        history = [t for t in history if now - t < 86400]
-        self.user_history[user_id][target_history_key] = history
+    def _exhausted_pool(
+        self,
+        policy: _Policy,
+        user_group: _UserGroupPolicy,
+        model_group: _ModelGroupPolicy,
+    ) -> Optional[Tuple[_PoolPolicy, _QuotaProbe]]:
+        """Read-only: the first pool of the request with no room left."""
+        if policy.pool_matrix is None:
+            return None
+        for pool in policy.pool_matrix[user_group.index][model_group.index]:
+            history = self._pool_history.get(pool.id)
+            if history:
+                probe = self._probe_limits(pool.limits, history)
+                if probe.exhausted is not None:
+                    return pool, probe
+        return None
 
-        source_name = f"{user_group.get('name')} → {model_group.get('name')}"
-        is_limited, reason = self._check_specific_limit(
-            source_name, model_perms, history
-        )
-        return is_limited, reason
+    def _record_pool_hits(
+        self,
+        policy: _Policy,
+        user_group: _UserGroupPolicy,
+        model_group: _ModelGroupPolicy,
+        now: float,
+    ) -> None:
+        for pool in policy.pool_matrix[user_group.index][model_group.index]:
+            history = self._pool_history.get(pool.id)
+            if history is None:
+                history = self._pool_history[pool.id] = []
+            bisect.insort(history, now)
+
+    def pool_usage(self) -> Dict[str, Dict[str, Any]]:
+        """Requests left per window and `retry_after` for every pool."""
+        policy = self._get_policy()
+        report: Dict[str, Dict[str, Any]] = {}
+        for pool in policy.pools:
+            history = self._trim_history(self._pool_history.get(pool.id, []))
+            probe = self._probe_limits(pool.limits, history)
+            report[pool.id] = {
+                "name": pool.name,
+                "used_today": len(history),
+                "remaining": dict(probe.remaining),
+                "retry_after": probe.retry_after,
+            }
+        return report
 
     def _apply_context_clip(
         self,
         cfg: Dict[str, Any],
         body: dict,
-        user_group: Dict[str, Any],
-        model_group: Optional[Dict[str, Any]],
-        model_perms: Dict[str, Any],
-        perms_source: str,
+        user_group: _UserGroupPolicy,
+        model_group: Optional[_ModelGroupPolicy],
+        perm: _Permission,
     ) -> None:
         """
         Apply context clipping (max non-system messages) and log clip information.
         """
-        clip = self._coerce_nonneg_int(model_perms.get("clip", 0))
-        if clip <= 0:
+        clip = perm.clip
+        if clip <= 0 and not perm.clip_bytes and not perm.strip_attachments:
             return
 
-        messages, source = self._select_messages_with_source(body)
+        chat_id = self._chat_id(body)
+        state = None
+        if clip > 0 and chat_id is not None:
+            state = self._clip_cache.get(chat_id)
+        if state is not None and self._clip_incremental(body, state, clip):
+            self._clip_cache.move_to_end(chat_id)
+            messages = self._messages_at(body, state.source)
+            source = "body." + ".".join(state.source)
+        else:
+            messages, source = self._select_messages_with_source(body)
+            state = None
+            if clip > 0 and messages and chat_id is not None:
+                state = self._clip_scan(messages, source, clip)
+                self._clip_cache[chat_id] = state
+                if len(self._clip_cache) > self._CLIP_CACHE_MAX:
+                    self._clip_cache.popitem(last=False)
         if messages and body.get("messages") is not messages:
             body["messages"] = messages
 
         before_total = len(messages)
-        before_system = len([m for m in messages if m.get("role") == "system"])
+        budgeted = perm.clip_bytes or perm.strip_attachments
+        system_msgs: List[dict] = []
+        kept: List[dict] = []
+        if state is not None:
+            before_system = len(state.system)
+            clipped = before_total - before_system > clip
+            if clipped or budgeted:
+                # With no clip needed, `state.kept` holds every non-system message.
+                system_msgs = [messages[i] for i in state.system]
+                kept = [messages[i] for i in state.kept]
+        else:
+            system_msgs = [m for m in messages if m.get("role") == "system"]
+            kept = [m for m in messages if m.get("role") != "system"]
+            before_system = len(system_msgs)
+            clipped = 0 < clip < len(kept)
+            if clipped:
+                kept = kept[-clip:]
         before_non_system = before_total - before_system
 
-        applied = False
-        if before_total > 0:
-            system_msgs = [m for m in messages if m.get("role") == "system"]
-            non_system_msgs = [m for m in messages if m.get("role") != "system"]
-            if len(non_system_msgs) > clip:
-                body["messages"] = system_msgs + non_system_msgs[-clip:]
-                applied = True
-
-        out_msgs = body.get("messages", [])
-        if not isinstance(out_msgs, list):
-            out_msgs = []
-
-        after_total = len(out_msgs)
-        after_system = len(
-            [m for m in out_msgs if isinstance(m, dict) and m.get("role") == "system"]
-        )
+        stripped = dropped = 0
+        if budgeted and kept:
+            kept, stripped, dropped = self._fit_payload(system_msgs, kept, perm)
+        applied = bool(clipped or stripped or dropped)
+        if applied:
+            body["messages"] = system_msgs + kept
+
+        if messages:
+            # Output is `messages` itself or system + kept messages.
+            after_system = before_system
+            after_total = before_system + len(kept) if applied else before_total
+        else:
+            out_msgs = body.get("messages", [])
+            if not isinstance(out_msgs, list):
+                out_msgs = []
+            after_total = len(out_msgs)
+            after_system = len(
+                [
+                    m
+                    for m in out_msgs
+                    if isinstance(m, dict) and m.get("role") == "system"
+                ]
+            )
         after_non_system = after_total - after_system
 
         self._log(
@@ -891,13 +2608,9 @@ class Filter:
             "OAG",
             "Clip Info",
             {
-                "user_group": user_group.get("name", user_group.get("id")),
-                "model_group": (
-                    model_group.get("name", model_group.get("id"))
-                    if model_group
-                    else "Ungrouped"
-                ),
-                "perms_source": perms_source,
+                "user_group": user_group.label,
+                "model_group": model_group.label if model_group else "Ungrouped",
+                "perms_source": perm.source,
                 "clip": clip,
                 "messages_source": source,
                 "before": {
@@ -911,7 +2624,810 @@ class Filter:
                     "non_system": after_non_system,
                 },
                 "applied": applied,
+                **(
+                    {
+                        "clip_bytes": perm.clip_bytes,
+                        "strip_attachments": perm.strip_attachments,
+                        "stripped": stripped,
+                        "dropped_for_bytes": dropped,
+                    }
+                    if budgeted
+                    else {}
+                ),
+            },
+        )
+
+    def _fit_payload(
+        self, system_msgs: List[dict], kept: List[dict], perm: _Permission
+    ) -> Tuple[List[dict], int, int]:
+        """
+        Newest-first pass over the kept messages: attachments in all but the
+        last `strip_attachments` messages become placeholders, then older
+        messages are dropped once `clip_bytes` is spent. System messages are
+        charged first and always kept, as is the newest message.
+        Returns (messages, how many were stripped, how many dropped).
+        """
+        keep_files = perm.strip_attachments
+        budget = perm.clip_bytes
+        if budget:
+            budget -= sum(self._message_size(m) for m in system_msgs)
+        out: List[dict] = []
+        stripped = 0
+        for m in reversed(kept):
+            if keep_files and len(out) >= keep_files:
+                lean = self._strip_attachments(m)
+                if lean is not m:
+                    stripped += 1
+                    m = lean
+            if perm.clip_bytes:
+                size = self._message_size(m)
+                if out and size > budget:
+                    break
+                budget -= size
+            out.append(m)
+        out.reverse()
+        return out, stripped, len(kept) - len(out)
+
+    @classmethod
+    def _message_size(cls, message: dict) -> int:
+        """UTF-8 size of the strings a message carries (text, parts, images)."""
+        size = 0
+        for key in ("content", "images"):
+            value = message.get(key)
+            if isinstance(value, str):
+                size += cls._text_size(value)
+            elif isinstance(value, list):
+                for part in value:
+                    if isinstance(part, str):
+                        size += cls._text_size(part)
+                    elif isinstance(part, dict):
+                        for field in part.values():
+                            if isinstance(field, str):
+                                size += cls._text_size(field)
+                            elif isinstance(field, dict):
+                                for inner in field.values():
+                                    if isinstance(inner, str):
+                                        size += cls._text_size(inner)
+        return size
+
+    @staticmethod
+    def _text_size(text: str) -> int:
+        # isascii() is O(1); base64 payloads never need the encode.
+        return len(text) if text.isascii() else len(text.encode("utf-8"))
+
+    def _strip_attachments(self, message: dict) -> dict:
+        """
+        Copy of `message` with image/file/audio content parts and Ollama-style
+        `images` replaced by short text placeholders; `message` itself if it
+        carries none. The original dict is never modified.
+        """
+        lean: Optional[dict] = None
+        content = message.get("content")
+        if isinstance(content, list):
+            parts = []
+            for part in content:
+                kind = (
+                    self._ATTACHMENT_PARTS.get(part.get("type"))
+                    if isinstance(part, dict)
+                    else None
+                )
+                if kind:
+                    part = {"type": "text", "text": f"[{kind} omitted]"}
+                    lean = lean or dict(message)
+                parts.append(part)
+            if lean is not None:
+                lean["content"] = parts
+        images = message.get("images")
+        if isinstance(images, list) and images:
+            note = f"[{len(images)} image(s) omitted]"
+            lean = dict(lean or message)
+            lean.pop("images")
+            content = lean.get("content")
+            if isinstance(content, list):
+                lean["content"] = content + [{"type": "text", "text": note}]
+            else:
+                lean["content"] = f"{content}\n{note}" if content else note
+        return lean if lean is not None else message
+
+    @staticmethod
+    def _message_fingerprint(message: Any) -> Tuple[Any, int, int]:
+        """
+        (role, content length, content hash) of a message. Content parts and
+        Ollama `images` are hashed in place; attachments are never copied
+        into a serialized form.
+        """
+        images = None
+        if isinstance(message, dict):
+            role, content = message.get("role"), message.get("content")
+            images = message.get("images")
+        else:
+            role, content = None, message
+        size = len(content) if isinstance(content, (str, list)) else 0
+        if isinstance(content, str) and not images:
+            return role, size, hash(content)
+        return role, size, Filter._deep_hash((content, images))
+
+    @staticmethod
+    def _deep_hash(value: Any) -> int:
+        """Hash of JSON-like data (dicts and lists included)."""
+        if isinstance(value, dict):
+            return hash(tuple((k, Filter._deep_hash(v)) for k, v in value.items()))
+        if isinstance(value, (list, tuple)):
+            return hash(tuple(Filter._deep_hash(v) for v in value))
+        try:
+            return hash(value)
+        except TypeError:
+            return hash(repr(value))
+
+    @staticmethod
+    def _message_keys(messages: List[Any]) -> Tuple[Tuple[Any, ...], ...]:
+        """
+        (roles, contents) of `messages` as hashable tuples, for
+        `_ClipState.prefix`. Plain text chats hash their strings directly
+        (str hashes are cached); any other content falls back to
+        `_message_fingerprint`.
+        """
+        try:
+            roles = tuple([m["role"] for m in messages])
+            contents = tuple([m["content"] for m in messages])
+            hash(contents)
+            return roles, contents
+        except (KeyError, TypeError):
+            return (), tuple([Filter._message_fingerprint(m) for m in messages])
+
+    @staticmethod
+    def _clip_scan(messages: List[dict], source: str, clip: int) -> _ClipState:
+        """Full pass over a chat's messages, remembered for its next turn."""
+        state = _ClipState()
+        state.source = tuple(source.split(".")[1:])
+        state.clip = clip
+        state.count = len(messages)
+        state.prefix = hash(Filter._message_keys(messages))
+        state.system = []
+        state.kept = deque(maxlen=clip)
+        for i, m in enumerate(messages):
+            if m.get("role") == "system":
+                state.system.append(i)
+            else:
+                state.kept.append(i)
+        return state
+
+    def _clip_incremental(self, body: dict, state: _ClipState, clip: int) -> bool:
+        """
+        Bring `state` up to date by looking only at messages added since the
+        last turn of the chat. False (state untouched) when that is not safe:
+        another clip value, a shorter or rewritten history (any message seen
+        before hashes differently), or another candidate list at least as long.
+        """
+        if state.clip != clip:
+            return False
+        messages = self._messages_at(body, state.source)
+        if not isinstance(messages, list):
+            return False
+        count, old = len(messages), state.count
+        if count < old:
+            return False
+        roles, contents = keys = self._message_keys(messages)
+        if hash((roles[:old], contents[:old])) != state.prefix:
+            return False
+        for path in _MESSAGE_SOURCES:
+            other = self._messages_at(body, path)
+            if (
+                other is not messages
+                and isinstance(other, list)
+                and len(other) >= count
+            ):
+                return False
+        new = messages[old:]
+        for m in new:
+            if not isinstance(m, dict) or "role" not in m:
+                return False
+        for i, m in enumerate(new, old):
+            if m.get("role") == "system":
+                state.system.append(i)
+            else:
+                state.kept.append(i)
+        state.count = count
+        state.prefix = hash(keys)
+        return True
+
+    # ----------------------------
+    # Static decision (memoized)
+    # ----------------------------
+    def _get_static_decision(
+        self, policy: _Policy, email: str, model_id: str
+    ) -> _StaticDecision:
+        """
+        Resolve the part of the decision that only depends on identity, model
+        and config: exemption, auth domain, whitelist, bans and group/permission
+        lookup. `kind` is one of "exempt", "deny" (with `message`), "group"
+        (with user_group, model_group and perm) or "legacy" (tier system
+        resolves per request).
+        Results are memoized in a bounded LRU that is cleared whenever
+        `config_json` changes.
+        """
+        key = (self._normalize_email(email), model_id)
+        cache = self._static_cache
+        decision = cache.get(key)
+        if decision is not None:
+            cache.move_to_end(key)
+            return decision
+
+        decision = self._compute_static_decision(policy, key[0], model_id)
+        cache[key] = decision
+        if len(cache) > self._STATIC_CACHE_MAX:
+            cache.popitem(last=False)
+        return decision
+
+    def _compute_static_decision(
+        self, policy: _Policy, email: str, model_id: str
+    ) -> _StaticDecision:
+        if policy.exemption is not None and email in policy.exemption:
+            return _StaticDecision("exempt")
+
+        if policy.auth_domains is not None:
+            domain = email.split("@")[-1].strip().casefold() if "@" in email else ""
+            if domain not in policy.auth_domains:
+                return _StaticDecision("deny", policy.auth_deny_msg)
+
+        if policy.whitelist is not None and email not in policy.whitelist:
+            return _StaticDecision(
+                "deny",
+                policy.strings.get(
+                    "whitelist_deny", "Access Denied: Not in whitelist."
+                ),
+            )
+
+        ban = policy.bans.get(email)
+        for i, f, msg in policy.ban_files:
+            if ban is not None and i >= ban[0]:
+                break
+            if email in f.entries:
+                ban = (i, msg)
+                break
+        if ban is not None:
+            return _StaticDecision("deny", ban[1])
+
+        if policy.legacy:
+            return _StaticDecision("legacy")
+
+        user_group = self._get_user_group(policy, email)
+        model_group = self._get_model_group(policy, model_id)
+        perm = policy.matrix[user_group.index][
+            model_group.index + 1 if model_group else 0
+        ]
+        return _StaticDecision("group", None, user_group, model_group, perm)
+
+    # ----------------------------
+    # Batch evaluation (read-only)
+    # ----------------------------
+    def evaluate_batch(
+        self, requests: Iterable[Tuple[Union[Dict[str, Any], str], str]]
+    ) -> List[Dict[str, Any]]:
+        """
+        What-if check of many (user, model id) pairs against the current
+        config, for admin tooling. `user` is an Open WebUI user dict (`id`,
+        `email`, `role`) or a bare email. Nothing is recorded and the inlet
+        decision memo is left untouched.
+
+        Each result has `decision` ("allow", "exempt", "deny", "limited",
+        "fallback", "bypass" when the filter does not apply, or "legacy"),
+        `message`, `user_group`, `model_group`, the effective `permissions`
+        with their `permissions_source`, `remaining` requests per window and
+        `retry_after` seconds when the quota is used up.
+        """
+        policy = self._get_policy()
+        decisions: Dict[Tuple[str, str], _StaticDecision] = {}
+        quotas: Dict[Tuple[str, str, int], _QuotaProbe] = {}
+        results: List[Dict[str, Any]] = []
+
+        for user, model in requests:
+            if isinstance(user, str):
+                user = {"email": user}
+            email = user.get("email", "") or ""
+            user_id = user.get("id") or email or "anonymous"
+            model_id = self._normalize_model_id(model)
+            result: Dict[str, Any] = {
+                "user": user_id,
+                "model": model_id,
+                "decision": "allow",
+                "message": None,
+                "user_group": None,
+                "model_group": None,
+                "permissions": None,
+                "permissions_source": None,
+                "remaining": None,
+                "retry_after": 0.0,
+                "fallback_model": None,
+            }
+            results.append(result)
+
+            if not policy.enabled or (
+                user.get("role", "user") == "admin" and not policy.admin_effective
+            ):
+                result["decision"] = "bypass"
+                continue
+
+            key = (self._normalize_email(email), model_id)
+            static = decisions.get(key)
+            if static is None:
+                static = self._compute_static_decision(policy, key[0], model_id)
+                decisions[key] = static
+            if static.kind != "group":
+                result["decision"] = static.kind
+                result["message"] = static.message
+                continue
+
+            user_group, model_group, perm = (
+                static.user_group,
+                static.model_group,
+                static.perm,
+            )
+            if policy.adaptive is not None and model_group is not None:
+                perm = self._adaptive_perm(user_group, model_group, perm)
+            if self._generation:
+                self._apply_resets(user_id, user_group)
+            result["user_group"] = user_group.id
+            result["model_group"] = model_group.id if model_group else None
+            result["permissions"] = dict(perm.raw)
+            result["permissions_source"] = perm.source
+            if perm.denied:
+                result["decision"] = "deny"
+                result["message"] = perm.deny_msg
+                continue
+            if model_group is None:
+                continue
+
+            history_key = "GLOBAL" if policy.global_limit else model_group.id
+            quota_key = (user_id, history_key, id(perm))
+            probe = quotas.get(quota_key)
+            if probe is None:
+                probe = self._probe_limits(
+                    perm, self._peek_history(user_id, history_key)
+                )
+                quotas[quota_key] = probe
+            result["remaining"] = dict(probe.remaining)
+            result["retry_after"] = probe.retry_after
+            reason = None
+            if probe.exhausted is not None:
+                reason = f"{perm.source_name} {probe.exhausted} Limit"
+            else:
+                pool = self._exhausted_pool(policy, user_group, model_group)
+                if pool is not None:
+                    reason = f"Pool {pool[0].name} {pool[1].exhausted} Limit"
+                    result["retry_after"] = pool[1].retry_after
+
+            if reason is not None:
+                target = (
+                    self._pick_fallback(policy, user_id, user_group, model_group)
+                    if model_group.fallback
+                    else None
+                )
+                if target is not None:
+                    result["fallback_model"] = target[0]
+                result["decision"] = (
+                    "fallback"
+                    if target is not None or policy.fallback_enabled
+                    else "limited"
+                )
+                result["message"] = self._rate_limit_message(
+                    policy, reason, result["retry_after"]
+                )
+        return results
+
+    def probe_quota(
+        self, user: Union[Dict[str, Any], str], model: str
+    ) -> Dict[str, Any]:
+        """
+        Read-only quota check for one request: same result as one
+        `evaluate_batch` entry, including `remaining` per window and
+        `retry_after` (seconds until a request would be accepted).
+        """
+        return self.evaluate_batch([(user, model)])[0]
+
+    def _pick_fallback(
+        self,
+        policy: _Policy,
+        user_id: str,
+        user_group: _UserGroupPolicy,
+        model_group: _ModelGroupPolicy,
+    ) -> Optional[Tuple[str, Optional[_ModelGroupPolicy], _Permission]]:
+        """
+        First entry of `model_group.fallback` the user may use, whose own
+        group limits still have room for them and whose in-flight count is
+        under its cap. Read-only; returns (model id, group, permissions).
+        """
+        now = self._now()
+        row = policy.matrix[user_group.index]
+        for model, target, max_inflight in model_group.fallback:
+            if max_inflight and self._inflight.count(model, now) >= max_inflight:
+                continue
+            perm = row[target.index + 1 if target else 0]
+            if target is None:
+                return model, None, perm
+            if perm.denied:
+                continue
+            if policy.adaptive is not None:
+                perm = self._adaptive_perm(user_group, target, perm)
+            key = "GLOBAL" if policy.global_limit else target.id
+            if self._probe_limits(perm, self._peek_history(user_id, key)).exhausted:
+                continue
+            if self._exhausted_pool(policy, user_group, target) is not None:
+                continue
+            return model, target, perm
+        return None
+
+    def _adaptive_perm(
+        self,
+        user_group: _UserGroupPolicy,
+        model_group: _ModelGroupPolicy,
+        perm: _Permission,
+    ) -> _Permission:
+        """`perm` with rpm/rph/window limits scaled by the current factor."""
+        state = self._adaptive.get(model_group.id)
+        if state is None:
+            return perm
+        factor = state.factors.get(user_group.id, 1.0)
+        if factor >= 1.0:
+            return perm
+        key = (id(perm), factor)
+        scaled = state.scaled.get(key)
+        if scaled is None:
+            scaled = copy.copy(perm)
+            for name in ("rpm", "rph", "win_limit"):
+                value = getattr(perm, name)
+                if value > 0:
+                    setattr(scaled, name, max(1, int(value * factor)))
+            state.scaled[key] = scaled
+        return scaled
+
+    def _adapt_limits(
+        self, adaptive: _AdaptiveConfig, group_id: str, latency: float
+    ) -> None:
+        """
+        AIMD step for one model group, at most once per `interval`: over the
+        target latency, multiply the factor of the lowest-priority user group
+        not yet at `min_factor` by `decrease`; at or under it, add `increase`
+        back to the highest-priority group not yet at 1.
+        """
+        state = self._adaptive.get(group_id)
+        if state is None:
+            state = self._adaptive[group_id] = _AdaptiveState()
+        if state.latency is None:
+            state.latency = latency
+        else:
+            alpha = _InflightTracker.LATENCY_ALPHA
+            state.latency += alpha * (latency - state.latency)
+
+        now = self._now()
+        if now < state.next_adjust:
+            return
+        state.next_adjust = now + adaptive.interval
+        target = adaptive.targets.get(group_id, adaptive.target_latency)
+        factors = state.factors
+        if state.latency > target:
+            for ug_id in adaptive.order:
+                factor = factors.get(ug_id, 1.0)
+                if factor > adaptive.min_factor:
+                    factors[ug_id] = max(
+                        adaptive.min_factor, factor * adaptive.decrease
+                    )
+                    break
+            else:
+                return
+        else:
+            for ug_id in reversed(adaptive.order):
+                factor = factors.get(ug_id, 1.0)
+                if factor < 1.0:
+                    factors[ug_id] = min(1.0, factor + adaptive.increase)
+                    break
+            else:
+                return
+        state.scaled.clear()
+
+    def adaptive_state(self) -> Dict[str, Dict[str, Any]]:
+        """Average latency and per-user-group limit factors per model group."""
+        return {
+            group_id: {"latency": state.latency, "factors": dict(state.factors)}
+            for group_id, state in self._adaptive.items()
+        }
+
+    def _observe_chunk(self, event: Any, user: dict, metadata: Optional[dict]) -> None:
+        """
+        Per-chunk telemetry: O(1) dict work. The first chunk carrying content
+        records time-to-first-token for the request's model group.
+        """
+        if not isinstance(event, dict):
+            return
+        user_id = user.get("id") or user.get("email") or "anonymous"
+        key = self._request_key(metadata or {}, user_id)
+        tracker = self._inflight
+        stream = tracker.streams.get(key)
+        now = self._now()
+        if stream is None:
+            request = tracker.requests.get(key)
+            if request is None or not self._chunk_has_content(event):
+                return
+            stream = tracker.streams[key] = [now, now, 0, None]
+            self._histogram(request[2], "ttft").observe(now - request[1])
+        stream[1] = now
+        stream[2] += 1
+        usage = event.get("usage")
+        if isinstance(usage, dict) and usage.get("completion_tokens"):
+            stream[3] = usage["completion_tokens"]
+
+    @staticmethod
+    def _chunk_has_content(event: dict) -> bool:
+        for choice in event.get("choices") or ():
+            delta = choice.get("delta") if isinstance(choice, dict) else None
+            if isinstance(delta, dict) and delta.get("content"):
+                return True
+        return False
+
+    def _observe_stream_end(self, group: Optional[str], stream: List[Any]) -> None:
+        """Tokens/sec between the first and last chunk; usage wins if sent."""
+        first, last, chunks, tokens = stream
+        if last > first:
+            rate = (tokens or chunks) / (last - first)
+            self._histogram(group, "tokens_per_second").observe(rate)
+
+    def _histogram(self, group: Optional[str], name: str) -> _Histogram:
+        per_group = self._telemetry.get(group or "ungrouped")
+        if per_group is None:
+            per_group = self._telemetry[group or "ungrouped"] = {
+                "ttft": _Histogram(self._TTFT_BUCKETS),
+                "tokens_per_second": _Histogram(self._TPS_BUCKETS),
+            }
+        return per_group[name]
+
+    def stream_telemetry(self) -> Dict[str, Dict[str, Any]]:
+        """TTFT (seconds) and tokens/sec histograms per model group."""
+        return {
+            group: {name: h.snapshot() for name, h in hists.items()}
+            for group, hists in self._telemetry.items()
+        }
+
+    def _route_replica(self, model_group: _ModelGroupPolicy) -> str:
+        """Replica with the fewest in-flight requests / lowest latency."""
+        inflight = self._inflight
+        now = self._now()
+        if model_group.routing == "least_latency":
+            # Expected wait: latency scaled by queue depth. Unmeasured replicas
+            # count as fastest so each gets sampled; ties go to the idlest.
+            latency = inflight.latency
+
+            def cost(m: str) -> Tuple[float, int]:
+                active = inflight.count(m, now)
+                return latency.get(m, 0.0) * (active + 1), active
+
+            return min(model_group.replicas, key=cost)
+        return min(model_group.replicas, key=lambda m: inflight.count(m, now))
+
+    def model_load(self) -> Dict[str, Dict[str, Any]]:
+        """In-flight requests and average latency (seconds) per target model."""
+        now = self._now()
+        inflight = self._inflight
+        models = set(inflight.by_model) | set(inflight.latency)
+        return {
+            m: {"inflight": inflight.count(m, now), "latency": inflight.latency.get(m)}
+            for m in sorted(models)
+        }
+
+    @staticmethod
+    def _request_key(
+        body: dict, user_id: str, model: Any = None
+    ) -> Tuple[str, Any, Any, Optional[str]]:
+        """
+        Pairs an inlet with its stream chunks and outlet: (user id, chat id,
+        message id, None). Open WebUI gives each response its own message id,
+        so concurrent requests of a multi-model chat stay apart. Without one
+        (API clients) the requested model id takes its place; `model` stands
+        in for `body["model"]` once inlet has rerouted the request.
+        """
+        meta = body.get("metadata")
+        message_id = meta.get("message_id") if isinstance(meta, dict) else None
+        if message_id is None:
+            message_id = body.get("message_id", body.get("id"))
+        if message_id is not None:
+            return user_id, Filter._chat_id(body), message_id, None
+        return (
+            user_id,
+            Filter._chat_id(body),
+            None,
+            Filter._normalize_model_id(body.get("model") if model is None else model),
+        )
+
+    @staticmethod
+    def _chat_id(body: dict) -> Any:
+        chat_id = body.get("chat_id")
+        if chat_id is None:
+            meta = body.get("metadata")
+            if isinstance(meta, dict):
+                chat_id = meta.get("chat_id")
+        return chat_id
+
+    def _remember_block(self, key: Tuple[str, str], perm: _Permission) -> None:
+        """
+        Store when each exhausted window of `perm` frees up for `key`, sorted
+        so the last entry is the time the block ends. Any hit recorded on the
+        same history drops the entry, so these times stay exact.
+        """
+        probe = self._probe_limits(perm, self._peek_history(key[0], key[1]))
+        if not probe.frees_at:
+            return
+        blocked = self._blocked
+        if len(blocked) >= self._BLOCKED_MAX:
+            now = self._now()
+            for stale in [k for k, v in blocked.items() if v[1][-1][1] <= now]:
+                del blocked[stale]
+            while len(blocked) >= self._BLOCKED_MAX:
+                del blocked[next(iter(blocked))]
+        blocked[key] = (perm, sorted(probe.frees_at, key=lambda w: w[1]))
+
+    def stats(self) -> Dict[str, int]:
+        """Runtime counters, e.g. for a metrics endpoint."""
+        return {
+            "short_circuited": self._short_circuited,
+            "blocked_entries": len(self._blocked),
+            "events_pending": len(self._emit_tasks),
+            "events_dropped": self._emit_dropped,
+            "duplicates": self._dedup_hits,
+            "dedup_entries": len(self._dedup),
+        }
+
+    def _dedup_key(
+        self, dedup: _DedupConfig, messages: List[Any], user_id: str, model_id: str
+    ) -> Tuple[str, str, int]:
+        """O(`dedup.messages`): only the tail is fingerprinted."""
+        tail = messages[-dedup.messages :]
+        return (
+            user_id,
+            model_id,
+            hash(tuple([self._message_fingerprint(m) for m in tail])),
+        )
+
+    def _remember_request(
+        self, dedup: _DedupConfig, key: Tuple[str, str, int], now: float
+    ) -> None:
+        seen = self._dedup
+        while seen and next(iter(seen.values())) <= now:
+            seen.popitem(last=False)
+        seen[key] = now + dedup.window
+        seen.move_to_end(key)
+        while len(seen) > dedup.max_entries:
+            seen.popitem(last=False)
+
+    def _emit(
+        self, emitter: Callable[[Any], Awaitable[None]], event: Dict[str, Any]
+    ) -> None:
+        """
+        Send a UI status event in the background so `inlet` never waits on
+        the client's websocket. At most `_EMIT_MAX_PENDING` sends run at once
+        and each gets `_EMIT_TIMEOUT` seconds; anything over the limit, timed
+        out or failing is dropped and counted.
+        """
+        if len(self._emit_tasks) >= self._EMIT_MAX_PENDING:
+            self._emit_dropped += 1
+            return
+        task = asyncio.ensure_future(self._emit_with_timeout(emitter, event))
+        self._emit_tasks.add(task)
+        task.add_done_callback(self._emit_tasks.discard)
+
+    async def _emit_with_timeout(
+        self, emitter: Callable[[Any], Awaitable[None]], event: Dict[str, Any]
+    ) -> None:
+        try:
+            await asyncio.wait_for(emitter(event), self._EMIT_TIMEOUT)
+        except Exception:
+            self._emit_dropped += 1
+
+    def memory_report(self, top: int = 10, trace: bool = False) -> Dict[str, Any]:
+        """
+        Approximate memory held by per-user state, from container sizes and
+        entry counts (no per-timestamp walk), so it is cheap enough for a
+        periodic health check.
+
+        `bytes` splits `user_history` by key type: "user" (id and per-user
+        dict), "model_group", "GLOBAL", "ungrouped" and "legacy_model" (v0.1
+        model ids or keys of model groups no longer configured). `top_users`
+        lists the heaviest users. With `trace`, the bytes still allocated from
+        this module's code are reported next to the estimate, to validate it.
+        That needs tracemalloc to be running already (e.g. PYTHONTRACEMALLOC=1
+        at startup); it is never switched on here, as it slows down every
+        allocation of the process. Otherwise `traced_bytes` is None.
+        """
+        policy = self._get_policy()
+        group_ids = {mg.id for mg in policy.model_groups}
+        float_size = sys.getsizeof(0.0)
+        by_type = {
+            "user": 0,
+            "model_group": 0,
+            "GLOBAL": 0,
+            "ungrouped": 0,
+            "legacy_model": 0,
+        }
+        keys = timestamps = 0
+        per_user: List[Tuple[int, str, int, int]] = []
+        for user_id, histories in self.user_history.items():
+            user_bytes = sys.getsizeof(user_id) + sys.getsizeof(histories)
+            by_type["user"] += user_bytes
+            count = 0
+            for key, history in histories.items():
+                size = sys.getsizeof(history) + len(history) * float_size
+                if key in ("GLOBAL", "ungrouped"):
+                    by_type[key] += size
+                elif key in group_ids:
+                    by_type["model_group"] += size
+                else:
+                    by_type["legacy_model"] += size
+                user_bytes += size
+                count += len(history)
+            keys += len(histories)
+            timestamps += count
+            per_user.append((user_bytes, user_id, len(histories), count))
+
+        pool_bytes = sum(
+            sys.getsizeof(h) + len(h) * float_size for h in self._pool_history.values()
+        )
+        usage_bytes = (
+            sum(c.nbytes for c in self._usage.columns) if self._usage is not None else 0
+        )
+        report: Dict[str, Any] = {
+            "users": len(self.user_history),
+            "keys": keys,
+            "timestamps": timestamps,
+            "bytes": by_type,
+            "total_bytes": sum(by_type.values()) + pool_bytes + usage_bytes,
+            "top_users": [
+                {"user": user_id, "keys": n, "timestamps": count, "bytes": size}
+                for size, user_id, n, count in heapq.nlargest(top, per_user)
+            ],
+            "other": {
+                "pool_bytes": pool_bytes,
+                "usage_log_bytes": usage_bytes,
+                "static_cache_entries": len(self._static_cache),
+                "blocked_entries": len(self._blocked),
+                "inflight_requests": len(self._inflight.requests),
+                "migrated_users": len(self._migrated_upto),
+                "reset_stamps": len(self._reset_seen),
+                "dedup_entries": len(self._dedup),
             },
+        }
+        if trace:
+            report["traced_bytes"] = None
+            if tracemalloc.is_tracing():
+                # Open WebUI execs plugin source, so `__file__` is not where
+                # the code lives; the code objects know the real name.
+                snapshot = tracemalloc.take_snapshot().filter_traces(
+                    [tracemalloc.Filter(True, Filter.inlet.__code__.co_filename)]
+                )
+                report["traced_bytes"] = sum(
+                    stat.size for stat in snapshot.statistics("filename")
+                )
+        return report
+
+    def _rate_limit_message(
+        self, policy: _Policy, reason: Optional[str], retry_after: float
+    ) -> str:
+        return policy.strings.get(
+            "rate_limit_deny", "Rate Limit Exceeded: {reason}"
+        ).format(reason=reason, retry_after=math.ceil(retry_after))
+
+    async def usage_report(self) -> Dict[str, Any]:
+        """
+        Requests per user, user group and model group over the last minute,
+        hour and day (`reporting.enabled`, needs numpy). The log is copied on
+        the event loop and aggregated in a worker thread.
+        """
+        self._get_policy()
+        usage = self._usage
+        if usage is None:
+            raise Exception(
+                "Usage reporting is not available: enable `reporting` and "
+                "install numpy."
+            )
+        return await asyncio.to_thread(
+            _UsageLog.aggregate, usage.snapshot(), self._now()
         )
 
     # ----------------------------
@@ -928,13 +3444,13 @@ class Filter:
         Performs authentication, whitelist/blacklist checks, tier/group resolution,
         rate limiting, context clipping, and ad injection.
         """
-        cfg = self._get_cfg()
+        policy = self._get_policy()
+        cfg = policy.cfg
 
         def get_msg(key: str, default: str) -> str:
-            cs = cfg.get("custom_strings", {})
-            return cs.get(key, default) if isinstance(cs, dict) else default
+            return policy.strings.get(key, default)
 
-        if not cfg.get("base", {}).get("enabled", True):
+        if not policy.enabled:
             return body
 
         if not __user__:
@@ -949,116 +3465,173 @@ class Filter:
             cfg, "INLET", "Request Received", {"user": __user__, "model": model_id}
         )
 
-        if role == "admin" and not cfg.get("base", {}).get("admin_effective", False):
+        if role == "admin" and not policy.admin_effective:
             return body
 
-        if cfg.get("exemption", {}).get("enabled", False) and self._email_in_list(
-            email, cfg.get("exemption", {}).get("emails")
-        ):
+        static = self._get_static_decision(policy, email, model_id)
+        if static.kind == "exempt":
             self._log(cfg, "OAG", "Exempted User", self._normalize_email(email))
             return body
-
-        if cfg.get("auth", {}).get("enabled", False):
-            domain = email.split("@")[-1].strip().casefold() if "@" in email else ""
-            providers = cfg.get("auth", {}).get("providers", [])
-            if not isinstance(providers, list) or domain not in [
-                str(p).strip().casefold() for p in providers
-            ]:
-                raise Exception(cfg.get("auth", {}).get("deny_msg", "Access Denied"))
-
-        if cfg.get("whitelist", {}).get("enabled", False) and not self._email_in_list(
-            email, cfg.get("whitelist", {}).get("emails")
-        ):
-            raise Exception(
-                get_msg("whitelist_deny", "Access Denied: Not in whitelist.")
-            )
-
-        for reason in (
-            cfg.get("ban_reasons", [])
-            if isinstance(cfg.get("ban_reasons"), list)
-            else []
-        ):
-            if not isinstance(reason, dict):
-                continue
-            if self._email_in_list(email, reason.get("emails", [])):
-                raise Exception(reason.get("msg", "Account Suspended"))
+        if static.kind == "deny":
+            raise Exception(static.message)
 
         # === NEW: Group System Logic (v0.2.0+) ===
-        if isinstance(cfg.get("user_groups"), list) and len(cfg["user_groups"]) > 0:
-            user_group = self._get_user_group(cfg, email)
-            model_group = self._get_model_group(cfg, model_id)
-            model_perms, perms_source = self._get_effective_group_permissions(
-                user_group, model_group
-            )
+        if static.kind == "group":
+            user_group = static.user_group
+            model_group = static.model_group
+            perm = static.perm
+            if policy.adaptive is not None and model_group is not None:
+                perm = self._adaptive_perm(user_group, model_group, perm)
+            if self._generation:
+                self._apply_resets(user_id, user_group)
+
+            # Requests that can only be rejected until a known time are
+            # answered from the blocked entry, without touching history.
+            # False once the global fallback model replaces the request.
+            routed = True
+            block_key = None
+            if (
+                model_group is not None
+                and not model_group.fallback
+                and not policy.fallback_enabled
+            ):
+                block_key = (
+                    user_id,
+                    "GLOBAL" if policy.global_limit else model_group.id,
+                )
+                blocked = self._blocked.get(block_key)
+                if blocked is not None and blocked[0] is perm:
+                    blocked = blocked[1]
+                    now = self._now()
+                    frees_at = blocked[-1][1]
+                    if now < frees_at:
+                        self._short_circuited += 1
+                        label = next(w for w, t in blocked if t > now)
+                        raise Exception(
+                            self._rate_limit_message(
+                                policy,
+                                f"{perm.source_name} {label} Limit",
+                                frees_at - now,
+                            )
+                        )
+                    del self._blocked[block_key]
+
+            # Double-clicks and client retries: the same trailing messages
+            # from the same user to the same model within `dedup.window`.
+            # The request's own list is used as is; only clipping looks for
+            # (and validates) other history fields.
+            dedup_key = None
+            if policy.dedup is not None:
+                messages = body.get("messages")
+                if not isinstance(messages, list):
+                    messages = self._select_messages(body)
+                dedup_key = self._dedup_key(policy.dedup, messages, user_id, model_id)
+                expires = self._dedup.get(dedup_key)
+                if expires is not None and self._now() < expires:
+                    self._dedup_hits += 1
+                    message = policy.strings.get(
+                        "duplicate_deny", "Duplicate request ignored."
+                    ).format(window=policy.dedup.window)
+                    if policy.dedup.action == "reject":
+                        raise Exception(message)
+                    if __event_emitter__:
+                        self._emit(
+                            __event_emitter__,
+                            {
+                                "type": "status",
+                                "data": {"description": message, "done": True},
+                            },
+                        )
 
             self._log(
                 cfg,
                 "OAG",
                 "Group Match",
                 {
-                    "user_group": user_group.get("name"),
-                    "model_group": (
-                        model_group.get("name") if model_group else "Ungrouped"
-                    ),
-                    "model_group_id": (model_group.get("id") if model_group else None),
-                    "perms_source": perms_source,
-                    "effective_clip": model_perms.get("clip"),
+                    "user_group": user_group.name,
+                    "model_group": model_group.name if model_group else "Ungrouped",
+                    "model_group_id": model_group.id if model_group else None,
+                    "perms_source": perm.source,
+                    "effective_clip": perm.raw.get("clip"),
                 },
             )
 
-            is_limited, limit_reason = self._check_rate_limit_group(
-                cfg=cfg,
+            is_limited, limit_reason, retry_after = self._check_rate_limit_group(
+                policy=policy,
                 user_id=user_id,
-                user_group=user_group,
                 model_group=model_group,
-                model_perms=model_perms,
+                perm=perm,
+                user_group=user_group,
             )
 
             if is_limited:
                 self._log(cfg, "OAG", "Rate Limit Hit", limit_reason)
-                if cfg.get("fallback", {}).get("enabled", False):
-                    fallback_model = cfg.get("fallback", {}).get("model")
-                    if isinstance(fallback_model, str) and fallback_model.strip():
-                        body["model"] = fallback_model
-                    if (
-                        cfg.get("fallback", {}).get("notify", True)
-                        and __event_emitter__
-                    ):
-                        await __event_emitter__(
-                            {
-                                "type": "status",
-                                "data": {
-                                    "description": cfg.get("fallback", {}).get(
-                                        "notify_msg", ""
-                                    ),
-                                    "done": True,
-                                },
-                            }
-                        )
+                target = (
+                    self._pick_fallback(policy, user_id, user_group, model_group)
+                    if model_group is not None and model_group.fallback
+                    else None
+                )
+                if target is not None:
+                    # The hit, clipping and in-flight count go to the target.
+                    body["model"], model_group, perm = target
+                    self._log(cfg, "OAG", "Fallback Chain", body["model"])
+                elif policy.fallback_enabled:
+                    if policy.fallback_model:
+                        body["model"] = policy.fallback_model
+                        routed = False
                 else:
+                    if block_key is not None:
+                        self._remember_block(block_key, perm)
                     raise Exception(
-                        get_msg(
-                            "rate_limit_deny", "Rate Limit Exceeded: {reason}"
-                        ).format(reason=limit_reason)
+                        self._rate_limit_message(policy, limit_reason, retry_after)
+                    )
+                if policy.fallback_notify and __event_emitter__:
+                    self._emit(
+                        __event_emitter__,
+                        {
+                            "type": "status",
+                            "data": {
+                                "description": policy.fallback_notify_msg,
+                                "done": True,
+                            },
+                        },
                     )
 
-            # Record access (per model_group or GLOBAL or ungrouped)
-            if user_id not in self.user_history:
-                self.user_history[user_id] = {}
+            if routed and model_group is not None and model_group.routing:
+                body["model"] = self._route_replica(model_group)
 
+            # Record access (per model_group or GLOBAL or ungrouped)
             target_history_key = (
                 "GLOBAL"
-                if cfg.get("global_limit", {}).get("enabled", False)
-                else (model_group.get("id") if model_group else "ungrouped")
+                if policy.global_limit
+                else (model_group.id if model_group else "ungrouped")
             )
-            if target_history_key not in self.user_history[user_id]:
-                self.user_history[user_id][target_history_key] = []
-            self.user_history[user_id][target_history_key].append(time.time())
+            now = self._now()
+            self._record_hit(user_id, target_history_key, now)
+            # Same step as the check above (no await in between), so pool
+            # slots cannot be claimed twice by concurrent requests.
+            if policy.pool_matrix is not None and model_group is not None:
+                self._record_pool_hits(policy, user_group, model_group, now)
+            if dedup_key is not None:
+                self._remember_request(policy.dedup, dedup_key, now)
+            if self._usage is not None:
+                self._usage.record(
+                    now,
+                    user_id,
+                    user_group.id,
+                    model_group.id if model_group else "ungrouped",
+                )
 
             # Context clipping (even for ungrouped models -> uses default_permissions)
-            self._apply_context_clip(
-                cfg, body, user_group, model_group, model_perms, perms_source
-            )
+            self._apply_context_clip(cfg, body, user_group, model_group, perm)
+
+            if policy.track_inflight:
+                self._inflight.start(
+                    self._request_key(body, user_id, model_id),
+                    self._normalize_model_id(body.get("model", "")),
+                    now,
+                    model_group.id if model_group else None,
+                )
 
         # === LEGACY: Tier System (v0.1.x, deprecated) ===
         else:
@@ -1107,45 +3680,32 @@ class Filter:
                                 ).format(m_tier=m_tier_id)
                             )
 
-            is_limited, limit_reason = self._check_rate_limit(
+            is_limited, limit_reason, retry_after = self._check_rate_limit(
                 cfg, user_id, email, model_id, u_tier_idx, m_tier_idx
             )
             if is_limited:
                 self._log(cfg, "OAG", "Rate Limit Hit", limit_reason)
-                if cfg.get("fallback", {}).get("enabled", False):
-                    fallback_model = cfg.get("fallback", {}).get("model")
-                    if isinstance(fallback_model, str) and fallback_model.strip():
-                        body["model"] = fallback_model
-                    if (
-                        cfg.get("fallback", {}).get("notify", True)
-                        and __event_emitter__
-                    ):
-                        await __event_emitter__(
+                if policy.fallback_enabled:
+                    if policy.fallback_model:
+                        body["model"] = policy.fallback_model
+                    if policy.fallback_notify and __event_emitter__:
+                        self._emit(
+                            __event_emitter__,
                             {
                                 "type": "status",
                                 "data": {
-                                    "description": cfg.get("fallback", {}).get(
-                                        "notify_msg", ""
-                                    ),
+                                    "description": policy.fallback_notify_msg,
                                     "done": True,
                                 },
-                            }
+                            },
                         )
                 else:
                     raise Exception(
-                        get_msg(
-                            "rate_limit_deny", "Rate Limit Exceeded: {reason}"
-                        ).format(reason=limit_reason)
+                        self._rate_limit_message(policy, limit_reason, retry_after)
                     )
             else:
-                target = (
-                    "GLOBAL"
-                    if cfg.get("global_limit", {}).get("enabled", False)
-                    else model_id
-                )
-                if target not in self.user_history[user_id]:
-                    self.user_history[user_id][target] = []
-                self.user_history[user_id][target].append(time.time())
+                target = "GLOBAL" if policy.global_limit else model_id
+                self._record_hit(user_id, target, self._now())
 
             clip_count = max(
                 self._coerce_nonneg_int(ut_cfg.get("clip", 0)),
@@ -1189,32 +3749,44 @@ class Filter:
                     )
 
         # Ads injection (applies to both systems)
-        if (
-            cfg.get("ads", {}).get("enabled", False)
-            and cfg.get("ads", {}).get("content")
-            and __event_emitter__
-        ):
-            content = cfg.get("ads", {}).get("content", [])
-            if isinstance(content, list):
-                valid_ads = [ad for ad in content if isinstance(ad, str) and ad.strip()]
-                if valid_ads:
-                    ad_text = random.choice(valid_ads)
-                    await __event_emitter__(
-                        {
-                            "type": "status",
-                            "data": {"description": f"AD: {ad_text}", "done": True},
-                        }
-                    )
+        if policy.ads and __event_emitter__:
+            ad_text = random.choice(policy.ads)
+            self._emit(
+                __event_emitter__,
+                {
+                    "type": "status",
+                    "data": {"description": f"AD: {ad_text}", "done": True},
+                },
+            )
 
         return body
 
     async def outlet(self, body: dict, __user__: Optional[dict] = None) -> dict:
         cfg = self._get_cfg()
         self._log(cfg, "OUTLET", "Response", {"user": __user__})
+        if self._inflight.requests and __user__:
+            user_id = __user__.get("id") or __user__.get("email") or "anonymous"
+            key = self._request_key(body, user_id)
+            stream = self._inflight.streams.pop(key, None)
+            done = self._inflight.finish(key, self._now())
+            if done is not None:
+                if stream is not None:
+                    self._observe_stream_end(done[2], stream)
+                if done[2] is not None:
+                    policy = self._get_policy()
+                    if policy.adaptive is not None:
+                        self._adapt_limits(policy.adaptive, done[2], done[1])
         return body
 
-    async def stream(self, event: Any, __user__: Optional[dict] = None) -> Any:
+    async def stream(
+        self,
+        event: Any,
+        __user__: Optional[dict] = None,
+        __metadata__: Optional[dict] = None,
+    ) -> Any:
         cfg = self._get_cfg()
+        if self._inflight.requests and __user__ and self._policy.telemetry:
+            self._observe_chunk(event, __user__, __metadata__)
         if cfg.get("logging", {}).get("enabled", False) and cfg.get("logging", {}).get(
             "stream", False
         ):
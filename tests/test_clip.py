@@ -0,0 +1,85 @@
+"""Incremental context clipping."""
+
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from oag import Filter  # noqa: E402
+
+USER = {"id": "u1", "email": "u1@example.com", "role": "user"}
+IMAGE = "data:image/png;base64," + "A" * 1_000_000
+
+
+def make_filter():
+    f = Filter(clock=lambda: 1_000_000.0)
+    f.valves.config_json = json.dumps(
+        {
+            "logging": {"enabled": False},
+            "model_groups": [{"id": "gpt", "name": "GPT", "models": ["gpt"]}],
+            "user_groups": [
+                {
+                    "id": "users",
+                    "name": "Users",
+                    "emails": [],
+                    "default_permissions": {"enabled": True, "clip": 2},
+                }
+            ],
+        }
+    )
+    return f
+
+
+def image_message(text):
+    return {
+        "role": "user",
+        "content": [
+            {"type": "text", "text": text},
+            {"type": "image_url", "image_url": {"url": IMAGE}},
+        ],
+    }
+
+
+def clip(f, messages):
+    body = {"model": "gpt", "messages": list(messages), "chat_id": "chat-1"}
+    return asyncio.run(f.inlet(body, __user__=USER))["messages"]
+
+
+def test_cache_keeps_no_messages():
+    f = make_filter()
+    history = [image_message("first"), {"role": "assistant", "content": "ok"}]
+    history.append(image_message("last"))
+    clip(f, history)
+    (state,) = f._clip_cache.values()
+    assert isinstance(state.prefix, int)
+
+
+def test_edited_middle_message_forces_full_scan():
+    f = make_filter()
+    history = [
+        {"role": "system", "content": "be brief"},
+        {"role": "user", "content": "a"},
+        {"role": "assistant", "content": "b"},
+        {"role": "user", "content": "c"},
+        {"role": "assistant", "content": "d"},
+    ]
+    clip(f, history)
+    history[2] = {"role": "system", "content": "now be verbose"}
+    history.append({"role": "user", "content": "e"})
+    assert clip(f, history) == [history[0], history[2], history[4], history[5]]
+
+
+def test_rewritten_last_message_forces_full_scan():
+    f = make_filter()
+    history = [
+        {"role": "user", "content": "a"},
+        {"role": "assistant", "content": "b"},
+        image_message("c"),
+    ]
+    clip(f, history)
+    edited = history[:2] + [image_message("edited"), {"role": "user", "content": "d"}]
+    assert clip(f, edited) == edited[-2:]
+    history.append({"role": "assistant", "content": "e"})
+    assert clip(f, history) == history[-2:]
@@ -0,0 +1,74 @@
+"""Duplicate-submission window."""
+
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from oag import Filter  # noqa: E402
+
+USER = {"id": "u1", "email": "u1@example.com", "role": "user"}
+
+
+def make_filter():
+    f = Filter(clock=lambda: 1_000_000.0)
+    f.valves.config_json = json.dumps(
+        {
+            "logging": {"enabled": False},
+            "dedup": {"enabled": True, "window": 2},
+            "model_groups": [{"id": "gpt", "name": "GPT", "models": ["gpt"]}],
+            "user_groups": [
+                {
+                    "id": "users",
+                    "name": "Users",
+                    "emails": [],
+                    "default_permissions": {"enabled": True},
+                }
+            ],
+        }
+    )
+    return f
+
+
+def photo(data):
+    return {
+        "role": "user",
+        "content": [
+            {"type": "text", "text": "what is this?"},
+            {
+                "type": "image_url",
+                "image_url": {"url": "data:image/png;base64," + data},
+            },
+        ],
+    }
+
+
+def send(f, message):
+    body = {"model": "gpt", "messages": [{"role": "system", "content": "s"}, message]}
+    try:
+        asyncio.run(f.inlet(body, __user__=USER))
+        return "ok"
+    except Exception as e:
+        return str(e)
+
+
+@pytest.mark.parametrize(
+    "first, second",
+    [
+        (photo("AAAA"), photo("BBBB")),
+        (
+            {"role": "user", "content": "look", "images": ["AAAA"]},
+            {"role": "user", "content": "look", "images": ["BBBB"]},
+        ),
+    ],
+)
+def test_different_attachments_are_not_duplicates(first, second):
+    f = make_filter()
+    assert send(f, first) == "ok"
+    assert send(f, second) == "ok"
+    assert send(f, second).startswith("Duplicate request ignored")
+    assert f.stats()["duplicates"] == 1
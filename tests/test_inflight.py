@@ -0,0 +1,252 @@
+"""In-flight tracking: request keys, latency samples and expiry."""
+
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from oag import Filter  # noqa: E402
+
+USER = {"id": "u1", "email": "u1@example.com", "role": "user"}
+
+
+def make_filter(config, start=1_000_000.0):
+    clock = [start]
+    f = Filter(clock=lambda: clock[0])
+    base = {
+        "logging": {"enabled": False},
+        "user_groups": [
+            {
+                "id": "users",
+                "name": "Users",
+                "emails": [],
+                "default_permissions": {"enabled": True},
+            }
+        ],
+    }
+    base.update(config)
+    f.valves.config_json = json.dumps(base)
+    return f, clock
+
+
+def request(model, chat_id="chat-1", message_id=None):
+    metadata = {"chat_id": chat_id}
+    if message_id is not None:
+        metadata["message_id"] = message_id
+    return {"model": model, "messages": [], "metadata": metadata}
+
+
+def completed(model, chat_id="chat-1", message_id=None):
+    """Outlet body as Open WebUI sends it once a response is done."""
+    return {"model": model, "messages": [], "chat_id": chat_id, "id": message_id}
+
+
+ROUTED = {
+    "model_groups": [
+        {
+            "id": "replicas",
+            "name": "Replicas",
+            "models": ["a", "b"],
+            "routing": "least_inflight",
+        },
+        {
+            "id": "other",
+            "name": "Other",
+            "models": ["c", "d"],
+            "routing": "least_inflight",
+        },
+    ]
+}
+
+
+def test_multi_model_chat_keeps_both_requests():
+    f, clock = make_filter(ROUTED)
+
+    async def run():
+        await f.inlet(request("a", message_id="m-a"), __user__=USER)
+        clock[0] += 0.01
+        await f.inlet(request("c", message_id="m-c"), __user__=USER)
+        return f.model_load()
+
+    load = asyncio.run(run())
+    assert load["a"]["inflight"] == 1
+    assert load["c"]["inflight"] == 1
+    assert load["a"]["latency"] is None
+
+
+def test_outlet_finishes_its_own_request():
+    f, clock = make_filter(ROUTED)
+
+    async def run():
+        await f.inlet(request("a", message_id="m-a"), __user__=USER)
+        await f.inlet(request("c", message_id="m-c"), __user__=USER)
+        clock[0] += 3
+        await f.outlet(completed("c", message_id="m-c"), __user__=USER)
+        return f.model_load()
+
+    load = asyncio.run(run())
+    assert load["a"] == {"inflight": 1, "latency": None}
+    assert load["c"]["inflight"] == 0
+    assert load["c"]["latency"] == 3
+
+
+def test_key_collision_records_no_latency():
+    f, clock = make_filter(ROUTED)
+
+    async def run():
+        # No message ids (API clients): both requests share a key.
+        await f.inlet(request("a"), __user__=USER)
+        clock[0] += 100
+        await f.inlet(request("a"), __user__=USER)
+        return f.model_load()
+
+    load = asyncio.run(run())
+    assert load["a"]["latency"] is None
+    assert sum(m["inflight"] for m in load.values()) == 1
+
+
+def test_max_inflight_counts_every_request_of_a_chat():
+    f, clock = make_filter(
+        {
+            "model_groups": [
+                {
+                    "id": "big",
+                    "name": "Big",
+                    "models": ["gpt"],
+                    "fallback": [{"model": "mid", "max_inflight": 1}, "small"],
+                },
+                {"id": "mid", "name": "Mid", "models": ["mid"]},
+                {"id": "small", "name": "Small", "models": ["small"]},
+                {"id": "other", "name": "Other", "models": ["other"]},
+            ],
+            "user_groups": [
+                {
+                    "id": "users",
+                    "name": "Users",
+                    "emails": [],
+                    "default_permissions": {"enabled": True},
+                    "permissions": {"big": {"enabled": True, "rpm": 1}},
+                }
+            ],
+        }
+    )
+
+    async def run():
+        routed = []
+        for model, message_id in [
+            ("gpt", "m0"),
+            ("mid", "m1"),
+            ("other", "m2"),
+            ("gpt", "m3"),
+        ]:
+            clock[0] += 0.1
+            body = await f.inlet(request(model, message_id=message_id), __user__=USER)
+            routed.append(body["model"])
+        return routed
+
+    # "mid" is still answering m1 when m3 falls back, so its cap is reached.
+    assert asyncio.run(run()) == ["gpt", "mid", "other", "small"]
+    assert f.model_load()["mid"]["inflight"] == 1
+
+
+TELEMETRY = {
+    "telemetry": {"enabled": True},
+    "model_groups": [
+        {"id": "gpt", "name": "GPT", "models": ["gpt"]},
+        {"id": "llama", "name": "Llama", "models": ["llama"]},
+    ],
+}
+
+
+def test_requests_without_outlet_expire():
+    f, clock = make_filter(TELEMETRY)
+    tracker = f._inflight
+
+    async def run():
+        for i in range(1000):
+            await f.inlet(request("gpt", f"chat-{i}", f"m-{i}"), __user__=USER)
+            await f.stream(
+                {"choices": [{"delta": {"content": "x"}}]},
+                __user__=USER,
+                __metadata__={"chat_id": f"chat-{i}", "message_id": f"m-{i}"},
+            )
+        clock[0] += tracker.ttl
+        await f.inlet(request("gpt", "chat-last", "m-last"), __user__=USER)
+
+    asyncio.run(run())
+    assert len(tracker.requests) == 1
+    assert sum(len(keys) for keys in tracker.by_model.values()) == 1
+    assert not tracker.streams
+
+
+def test_streams_of_one_chat_stay_apart():
+    f, clock = make_filter(TELEMETRY)
+
+    async def run():
+        for model, message_id in [("gpt", "m-gpt"), ("llama", "m-llama")]:
+            await f.inlet(request(model, message_id=message_id), __user__=USER)
+        for delay, message_id in [(1, "m-gpt"), (1, "m-llama")]:
+            clock[0] += delay
+            await f.stream(
+                {"choices": [{"delta": {"content": "x"}}]},
+                __user__=USER,
+                __metadata__={"chat_id": "chat-1", "message_id": message_id},
+            )
+        clock[0] += 1
+        for model, message_id in [("gpt", "m-gpt"), ("llama", "m-llama")]:
+            await f.outlet(completed(model, message_id=message_id), __user__=USER)
+
+    asyncio.run(run())
+    telemetry = f.stream_telemetry()
+    assert telemetry["gpt"]["ttft"]["mean"] == 1
+    assert telemetry["llama"]["ttft"]["mean"] == 2
+
+
+def test_reload_turning_features_off_stops_tracking():
+    f, clock = make_filter(
+        {"adaptive": {"enabled": True}, "telemetry": {"enabled": True}, **TELEMETRY}
+    )
+    asyncio.run(f.inlet(request("gpt", message_id="m-1"), __user__=USER))
+    assert f._get_policy().track_inflight
+    assert f._inflight.requests
+
+    # Only the adaptive/telemetry sections change, so model groups are shared.
+    config = json.loads(f.valves.config_json)
+    config["adaptive"]["enabled"] = False
+    config["telemetry"]["enabled"] = False
+    f.valves.config_json = json.dumps(config)
+    asyncio.run(f.inlet(request("gpt", message_id="m-2"), __user__=USER))
+
+    fresh, _ = make_filter({})
+    fresh.valves.config_json = f.valves.config_json
+    assert f._get_policy().track_inflight is fresh._get_policy().track_inflight
+    assert not f._get_policy().track_inflight
+    assert not f._inflight.requests
+
+
+def test_adaptive_latency_ignores_expired_and_colliding_requests():
+    f, clock = make_filter(
+        {
+            "adaptive": {"enabled": True, "target_latency": 5, "interval": 1},
+            "model_groups": [{"id": "gpt", "name": "GPT", "models": ["gpt"]}],
+        }
+    )
+    tracker = f._inflight
+
+    async def run():
+        # Never finished: expires instead of turning into a sample.
+        await f.inlet(request("gpt", "chat-1", "m-1"), __user__=USER)
+        clock[0] += tracker.ttl
+        # Same key twice (no message id): the first one is dropped silently.
+        await f.inlet(request("gpt", "chat-2"), __user__=USER)
+        clock[0] += 100
+        await f.inlet(request("gpt", "chat-2"), __user__=USER)
+        clock[0] += 2
+        await f.outlet(completed("gpt", "chat-2"), __user__=USER)
+
+    asyncio.run(run())
+    assert not tracker.requests
+    assert tracker.latency["gpt"] == 2
+    assert f.adaptive_state()["gpt"]["latency"] == 2
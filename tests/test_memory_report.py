@@ -0,0 +1,56 @@
+"""memory_report tracing."""
+
+import asyncio
+import json
+import os
+import tracemalloc
+import types
+
+SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "oag.py")
+
+
+def load_like_open_webui():
+    """Open WebUI execs the plugin source in a fresh module."""
+    module = types.ModuleType("function_oag")
+    with open(SOURCE, encoding="utf-8") as fh:
+        exec(fh.read(), module.__dict__)
+    return module.Filter
+
+
+def run_inlets(f, count):
+    async def run():
+        for i in range(count):
+            user = {"id": f"u{i}", "email": f"u{i}@example.com", "role": "user"}
+            await f.inlet({"model": "m", "messages": []}, __user__=user)
+
+    asyncio.run(run())
+
+
+def make_filter(cls):
+    f = cls()
+    f.valves.config_json = json.dumps(
+        {
+            "logging": {"enabled": False},
+            "user_groups": [
+                {"id": "users", "name": "Users", "default_permissions": {"rpm": 5}}
+            ],
+        }
+    )
+    return f
+
+
+def test_trace_never_starts_tracemalloc():
+    assert not tracemalloc.is_tracing()
+    f = make_filter(load_like_open_webui())
+    assert f.memory_report(trace=True)["traced_bytes"] is None
+    assert not tracemalloc.is_tracing()
+
+
+def test_trace_counts_execd_source():
+    tracemalloc.start()
+    try:
+        f = make_filter(load_like_open_webui())
+        run_inlets(f, 2000)
+        assert f.memory_report(trace=True)["traced_bytes"] > 0
+    finally:
+        tracemalloc.stop()
@@ -0,0 +1,96 @@
+"""reset_quotas scopes and shared pools."""
+
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from oag import Filter  # noqa: E402
+
+CONFIG = {
+    "logging": {"enabled": False},
+    "user_groups": [
+        {
+            "id": "team",
+            "name": "Team",
+            "emails": ["*@team.io"],
+            "default_permissions": {"enabled": True},
+        },
+        {"id": "default", "name": "Default", "default_permissions": {"enabled": True}},
+    ],
+    "model_groups": [
+        {"id": "g", "name": "G", "models": ["m"]},
+        {"id": "h", "name": "H", "models": ["n"]},
+    ],
+    "pools": [
+        {"id": "team", "name": "Team", "user_groups": ["team"], "rph": 2},
+        {
+            "id": "org",
+            "name": "Org",
+            "user_groups": ["team", "default"],
+            "model_groups": ["h"],
+            "rph": 2,
+        },
+    ],
+}
+
+
+def make_filter():
+    f = Filter(clock=lambda: 1_000_000.0)
+    f.valves.config_json = json.dumps(CONFIG)
+    return f
+
+
+async def send(f, email, model):
+    user = {"id": email, "email": email, "role": "user"}
+    try:
+        await f.inlet({"model": model, "messages": []}, __user__=user)
+        return "ok"
+    except Exception as e:
+        return str(e)
+
+
+def exhaust(f):
+    async def run():
+        for email in ("a@team.io", "b@team.io"):
+            assert await send(f, email, "m") == "ok"
+        for email in ("x@other.io", "y@other.io"):
+            assert await send(f, email, "n") == "ok"
+        assert "Pool Team" in await send(f, "c@team.io", "m")
+        assert "Pool Org" in await send(f, "z@other.io", "n")
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize(
+    "scope, team_freed, org_freed",
+    [
+        ({"user_group": "team"}, True, True),
+        ({"user_group": "default"}, False, True),
+        ({"model_group": "g"}, True, False),
+        ({"model_group": "h"}, True, True),
+        ({"model_group": "GLOBAL"}, True, True),
+        ({}, True, True),
+    ],
+)
+def test_group_resets_clear_their_pools(scope, team_freed, org_freed):
+    f = make_filter()
+    exhaust(f)
+    f.reset_quotas(**scope)
+    usage = f.pool_usage()
+    assert (usage["team"]["used_today"] == 0) is team_freed
+    assert (usage["org"]["used_today"] == 0) is org_freed
+    if org_freed:
+        assert asyncio.run(send(f, "z@other.io", "n")) == "ok"
+
+
+def test_user_reset_leaves_pools_alone():
+    f = make_filter()
+    exhaust(f)
+    f.reset_quotas(user="a@team.io")
+    assert f.pool_usage()["team"]["used_today"] == 2
+    assert "Pool Team" in asyncio.run(send(f, "a@team.io", "m"))
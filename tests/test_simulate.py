@@ -0,0 +1,60 @@
+"""Capacity simulator (tools/simulate.py)."""
+
+import asyncio
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+
+from simulate import CapacitySimulator  # noqa: E402
+
+CONFIG = {
+    "logging": {"enabled": False},
+    "user_groups": [
+        {
+            "id": "corp",
+            "name": "Corp",
+            "emails": ["boss@corp.com", "*@corp.com", "*@*.corp.io"],
+            "default_permissions": {"enabled": True},
+        },
+        {"id": "default", "name": "Default", "default_permissions": {"enabled": True}},
+    ],
+    "model_groups": [
+        {
+            "id": "big",
+            "name": "Big",
+            "models": ["h1/llama", "h2/llama"],
+            "routing": "least_inflight",
+        }
+    ],
+}
+TRAFFIC = {
+    "groups": {
+        "corp": {"users": 20, "rate_per_hour": 120, "models": ["h1/llama"]},
+    },
+    "backends": {
+        "h1/llama": {"concurrency": 2, "service_time": 30},
+        "h2/llama": {"concurrency": 2, "service_time": 30},
+    },
+}
+
+
+def test_domain_rules_get_distinct_matching_users():
+    sim = CapacitySimulator(CONFIG, TRAFFIC, hours=1)
+    emails = sim._group_emails("corp", 5, "sim.invalid")
+    assert emails[0] == "boss@corp.com"
+    assert len(set(emails)) == 5
+    f = sim.filter
+    assert {f._get_user_group(f._get_policy(), e).id for e in emails} == {"corp"}
+
+
+def test_routing_is_not_fallback_and_outlets_drain():
+    sim = CapacitySimulator(CONFIG, TRAFFIC, hours=1)
+    report = asyncio.run(sim.run())
+    corp = report["groups"]["corp"]
+    assert corp["requests"] > 0
+    assert corp["fallback_rate"] == 0
+    load = sim.filter.model_load()
+    assert load["h2/llama"]["latency"] is not None
+    assert not sim.filter._inflight.requests
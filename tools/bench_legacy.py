@@ -0,0 +1,140 @@
+"""
+Legacy tier benchmark for OpenAccess Guard.
+
+Builds a v0.1 tier config (`user_tiers` / `model_tiers` with access lists)
+and the equivalent group config, then times config load and `Filter.inlet`
+throughput for both, so the legacy path can be compared with the group
+system directly.
+
+Usage:
+    python tools/bench_legacy.py [--emails 10000] [--requests 50000] [--seed 0]
+"""
+
+import argparse
+import asyncio
+import copy
+import json
+import os
+import random
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from oag import Filter  # noqa: E402
+
+
+def legacy_config(emails: List[str], tiers: int = 4) -> Dict[str, Any]:
+    """
+    Users are spread over `tiers` user tiers; each model tier holds a handful
+    of models and blacklists (or, for odd tiers, whitelists) a slice of users.
+    """
+    per_tier = len(emails) // tiers or 1
+    user_tiers = [
+        {
+            "tier_id": t,
+            "tier_name": f"Tier {t}",
+            "emails": emails[t * per_tier : (t + 1) * per_tier],
+            "rpm": 5,
+            "rph": 60,
+            "clip": 20,
+        }
+        for t in range(tiers)
+    ]
+    model_tiers = [
+        {
+            "tier_id": t,
+            "tier_name": f"Models {t}",
+            "models": [f"model-{t}-{m}" for m in range(8)],
+            "mode_whitelist": t % 2 == 1,
+            "access_list": emails[t * per_tier : t * per_tier + per_tier // 2],
+        }
+        for t in range(tiers)
+    ]
+    return {
+        "user_groups": [],
+        "user_tiers": user_tiers,
+        "model_tiers": model_tiers,
+        "logging": {"enabled": False},
+    }
+
+
+def group_config(legacy: Dict[str, Any]) -> Dict[str, Any]:
+    """The same policy written natively with `user_groups` / `model_groups`."""
+    cfg = Filter()._migrate_config_to_groups(copy.deepcopy(legacy))
+    for key in ("user_tiers", "model_tiers"):
+        cfg.pop(key, None)
+    return json.loads(json.dumps(cfg))
+
+
+def workload(
+    rng: random.Random, emails: List[str], models: List[str], count: int
+) -> List[Tuple[Dict[str, Any], str]]:
+    users = [
+        {"id": f"bench-{i}", "email": email, "role": "user"}
+        for i, email in enumerate(emails)
+    ]
+    return [(rng.choice(users), rng.choice(models)) for _ in range(count)]
+
+
+async def run_inlet(
+    config: Dict[str, Any], requests: List[Tuple[Dict[str, Any], str]]
+) -> Dict[str, Any]:
+    clock = [1_700_000_000.0]
+    f = Filter(clock=lambda: clock[0])
+    f.valves.config_json = json.dumps(config, ensure_ascii=False)
+
+    started = time.perf_counter()
+    f._get_policy()
+    load = time.perf_counter() - started
+
+    accepted = 0
+    started = time.perf_counter()
+    for user, model in requests:
+        clock[0] += 0.05
+        body = {"model": model, "messages": [{"role": "user", "content": "hi"}]}
+        try:
+            await f.inlet(body, __user__=user)
+            accepted += 1
+        except Exception:
+            pass
+    elapsed = time.perf_counter() - started
+    return {
+        "load_seconds": round(load, 4),
+        "requests_per_second": round(len(requests) / elapsed) if elapsed else 0,
+        "accepted": accepted,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--emails", type=int, default=10_000)
+    parser.add_argument("--requests", type=int, default=50_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    emails = [f"user{i}@bench.invalid" for i in range(args.emails)]
+    legacy = legacy_config(emails)
+    grouped = group_config(legacy)
+    models = [m for tier in legacy["model_tiers"] for m in tier["models"]]
+    requests = workload(rng, emails, models, args.requests)
+
+    report = {
+        "emails": args.emails,
+        "requests": args.requests,
+        "legacy": asyncio.run(run_inlet(legacy, requests)),
+        "groups": asyncio.run(run_inlet(grouped, requests)),
+    }
+    report["legacy_vs_groups"] = round(
+        report["legacy"]["requests_per_second"]
+        / max(1, report["groups"]["requests_per_second"]),
+        3,
+    )
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,641 @@
+"""
+Differential fuzzer for OpenAccess Guard.
+
+Generates random configs, identities, model id shapes, message bodies and
+timestamp streams, and runs each one through a frozen copy of the original
+(v0.2.0) rate-limit, matching and clipping logic next to the compiled fast
+path in `oag.py`. Any disagreement is reported with the seed and case that
+produced it; per-engine timings give the speedup of the fast path.
+
+Usage:
+    python tools/fuzz.py [--cases 500] [--seed 0] [--engine all]
+
+Only configs the v0.2.0 semantics can express are generated: emails are
+plain addresses (no "*@domain" rules or membership files) and model entries
+are exact ids (no globs or "re:" patterns).
+"""
+
+import argparse
+import copy
+import json
+import os
+import random
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from oag import Filter  # noqa: E402
+
+
+# ----------------------------
+# Frozen reference (v0.2.0)
+# ----------------------------
+# Copied from the release before the compiled policy; keep these unchanged so
+# the fast path always has the original behaviour to be checked against.
+def ref_normalize_email(email: Any) -> str:
+    if email is None:
+        return ""
+    return str(email).strip().casefold()
+
+
+def ref_normalize_model_id(model_field: Any) -> str:
+    if isinstance(model_field, str):
+        return model_field
+    if isinstance(model_field, dict):
+        for key in ("id", "model", "name"):
+            value = model_field.get(key)
+            if isinstance(value, str):
+                return value
+        return ""
+    return str(model_field) if model_field is not None else ""
+
+
+def ref_model_id_variants(model_id: str) -> Set[str]:
+    if not isinstance(model_id, str):
+        return set()
+    raw = model_id.strip()
+    if not raw:
+        return set()
+
+    variants: Set[str] = {raw, raw.casefold()}
+    if "/" in raw:
+        tail = raw.split("/")[-1].strip()
+        if tail:
+            variants.add(tail)
+            variants.add(tail.casefold())
+    if ":" in raw:
+        base = raw.split(":")[0].strip()
+        if base:
+            variants.add(base)
+            variants.add(base.casefold())
+    if "/" in raw and ":" in raw:
+        tail = raw.split("/")[-1].strip()
+        base = tail.split(":")[0].strip()
+        if base:
+            variants.add(base)
+            variants.add(base.casefold())
+    return variants
+
+
+def ref_get_user_group(cfg: Dict[str, Any], email: str) -> Dict[str, Any]:
+    groups = cfg.get("user_groups", [])
+    if not isinstance(groups, list) or not groups:
+        raise Exception("Configuration Error: No user groups defined.")
+    email_norm = ref_normalize_email(email)
+    sorted_groups = sorted(
+        groups,
+        key=lambda g: (g.get("priority", 0) if isinstance(g, dict) else 0),
+        reverse=True,
+    )
+    for group in sorted_groups:
+        if not isinstance(group, dict):
+            continue
+        group_emails = group.get("emails", [])
+        if not isinstance(group_emails, list) or not group_emails:
+            continue
+        if any(ref_normalize_email(e) == email_norm for e in group_emails):
+            return group
+    for group in groups:
+        if not isinstance(group, dict):
+            continue
+        emails = group.get("emails", [])
+        if isinstance(emails, list) and len(emails) == 0:
+            return group
+    return (
+        groups[0]
+        if isinstance(groups[0], dict)
+        else {"id": "unknown", "name": "unknown"}
+    )
+
+
+def ref_get_model_group(cfg: Dict[str, Any], model_id: Any) -> Optional[Dict[str, Any]]:
+    groups = cfg.get("model_groups", [])
+    if not isinstance(groups, list):
+        return None
+    incoming = ref_normalize_model_id(model_id)
+    incoming_variants = ref_model_id_variants(incoming)
+    for group in groups:
+        if not isinstance(group, dict):
+            continue
+        models = group.get("models", [])
+        if not isinstance(models, list):
+            continue
+        for configured in models:
+            configured_id = ref_normalize_model_id(configured)
+            if not configured_id:
+                continue
+            if ref_model_id_variants(configured_id) & incoming_variants:
+                return group
+    return None
+
+
+def ref_check_specific_limit(
+    source_name: str, limits: Dict[str, Any], history: List[float], now: float
+) -> Tuple[bool, Optional[str]]:
+    rpm = limits.get("rpm", 0)
+    rph = limits.get("rph", 0)
+    w_lim = limits.get("win_limit", 0)
+    w_time = limits.get("win_time", 0)
+
+    if rpm > 0:
+        count = len([t for t in history if now - t < 60])
+        if count >= rpm:
+            return True, f"{source_name} RPM Limit"
+
+    if rph > 0:
+        count = len([t for t in history if now - t < 3600])
+        if count >= rph:
+            return True, f"{source_name} RPH Limit"
+
+    if w_lim > 0 and w_time > 0:
+        count = len([t for t in history if now - t < w_time * 60])
+        if count >= w_lim:
+            return True, f"{source_name} Window Limit"
+
+    return False, None
+
+
+def ref_effective_permissions(
+    user_group: Dict[str, Any], model_group: Optional[Dict[str, Any]]
+) -> Dict[str, Any]:
+    permissions = user_group.get("permissions", {})
+    if not isinstance(permissions, dict):
+        permissions = {}
+    if model_group and isinstance(model_group, dict):
+        mg_id = model_group.get("id")
+        if isinstance(mg_id, str):
+            model_perms = permissions.get(mg_id)
+            if isinstance(model_perms, dict) and len(model_perms) > 0:
+                return model_perms
+    default_perms = user_group.get("default_permissions", {})
+    if isinstance(default_perms, dict):
+        return default_perms
+    return {}
+
+
+def ref_coerce_nonneg_int(value: Any, default: int = 0) -> int:
+    try:
+        parsed = int(value)
+    except Exception:
+        return default
+    return parsed if parsed > 0 else 0
+
+
+def ref_select_messages_with_source(body: dict) -> Tuple[List[dict], str]:
+    if not isinstance(body, dict):
+        return [], "none"
+
+    def is_valid_messages(value: Any) -> bool:
+        if not isinstance(value, list):
+            return False
+        for item in value:
+            if not isinstance(item, dict):
+                return False
+            if "role" not in item:
+                return False
+        return True
+
+    candidates: List[Tuple[List[dict], str]] = []
+
+    def add_candidate(value: Any, source: str) -> None:
+        if is_valid_messages(value):
+            candidates.append((value, source))
+
+    keys = (
+        "messages",
+        "history",
+        "chat_history",
+        "conversation_messages",
+        "all_messages",
+    )
+    for key in keys:
+        add_candidate(body.get(key), f"body.{key}")
+
+    meta = body.get("metadata")
+    if isinstance(meta, dict):
+        for key in keys:
+            add_candidate(meta.get(key), f"body.metadata.{key}")
+
+    chat = body.get("chat")
+    if isinstance(chat, dict):
+        add_candidate(chat.get("messages"), "body.chat.messages")
+
+    conversation = body.get("conversation")
+    if isinstance(conversation, dict):
+        for key in keys:
+            add_candidate(conversation.get(key), f"body.conversation.{key}")
+        add_candidate(conversation.get("messages"), "body.conversation.messages")
+
+    data = body.get("data")
+    if isinstance(data, dict):
+        for key in keys:
+            add_candidate(data.get(key), f"body.data.{key}")
+
+    if not candidates:
+        return [], "none"
+
+    messages, source = max(candidates, key=lambda item: len(item[0]))
+    return messages, source
+
+
+def ref_apply_context_clip(body: dict, model_perms: Dict[str, Any]) -> None:
+    """Body rewrite of the v0.2.0 `_apply_context_clip` (logging left out)."""
+    clip = ref_coerce_nonneg_int(model_perms.get("clip", 0))
+    if clip <= 0:
+        return
+    messages, _ = ref_select_messages_with_source(body)
+    if messages and body.get("messages") is not messages:
+        body["messages"] = messages
+    if len(messages) > 0:
+        system_msgs = [m for m in messages if m.get("role") == "system"]
+        non_system_msgs = [m for m in messages if m.get("role") != "system"]
+        if len(non_system_msgs) > clip:
+            body["messages"] = system_msgs + non_system_msgs[-clip:]
+
+
+# ----------------------------
+# Generators
+# ----------------------------
+MODEL_NAMES = ["llama3", "Qwen2", "gpt-4o", "mistral", "DeepSeek-R1", "phi3"]
+PROVIDERS = ["", "openai/", "ollama/", "Local/", "a/b/"]
+TAGS = ["", ":8b", ":70B", ":latest", ": q4 ", ":"]
+
+
+def gen_model_id(rng: random.Random) -> str:
+    model = rng.choice(PROVIDERS) + rng.choice(MODEL_NAMES) + rng.choice(TAGS)
+    if rng.random() < 0.2:
+        model = model.upper() if rng.random() < 0.5 else model.lower()
+    if rng.random() < 0.15:
+        model = " " * rng.randint(1, 2) + model + " " * rng.randint(0, 2)
+    if rng.random() < 0.05:
+        model = "".join(rng.choice("/: aB") for _ in range(rng.randint(0, 5)))
+    return model
+
+
+def gen_model_field(rng: random.Random) -> Any:
+    """Incoming `body["model"]`: a string, or an object as some providers send."""
+    roll = rng.random()
+    if roll < 0.8:
+        return gen_model_id(rng)
+    if roll < 0.95:
+        key = rng.choice(["id", "model", "name"])
+        return {key: gen_model_id(rng)}
+    return rng.choice([None, 42, {"other": "x"}])
+
+
+def gen_email(rng: random.Random, pool: List[str]) -> str:
+    email = rng.choice(pool)
+    if rng.random() < 0.3:
+        email = email.upper()
+    if rng.random() < 0.2:
+        email = f"  {email} "
+    return email
+
+
+def gen_limits(rng: random.Random) -> Dict[str, Any]:
+    def value() -> Any:
+        roll = rng.random()
+        if roll < 0.3:
+            return 0
+        if roll < 0.85:
+            return rng.randint(1, 12)
+        return round(rng.uniform(0.5, 8.0), 2)
+
+    limits: Dict[str, Any] = {}
+    for key in ("rpm", "rph", "win_time", "win_limit"):
+        if rng.random() < 0.7:
+            limits[key] = value()
+    return limits
+
+
+def gen_permissions(rng: random.Random) -> Dict[str, Any]:
+    if rng.random() < 0.1:
+        return {}
+    perms = gen_limits(rng)
+    perms["enabled"] = rng.random() < 0.9
+    if rng.random() < 0.7:
+        perms["clip"] = rng.choice([0, 1, 2, 3, 5, -1, "4", 2.7, None, "x"])
+    return perms
+
+
+def gen_config(rng: random.Random, emails: List[str]) -> Dict[str, Any]:
+    model_groups = []
+    for m in range(rng.randint(0, 5)):
+        models = [gen_model_id(rng) for _ in range(rng.randint(0, 4))]
+        if rng.random() < 0.1:
+            models.append({"id": gen_model_id(rng)})
+        model_groups.append({"id": f"mg{m}", "name": f"Models {m}", "models": models})
+
+    user_groups = []
+    for u in range(rng.randint(1, 5)):
+        members = (
+            []
+            if rng.random() < 0.3
+            else [gen_email(rng, emails) for _ in range(rng.randint(1, 6))]
+        )
+        group: Dict[str, Any] = {
+            "id": f"ug{u}",
+            "name": f"Users {u}",
+            "emails": members,
+            "default_permissions": gen_permissions(rng),
+            "permissions": {
+                mg["id"]: gen_permissions(rng)
+                for mg in model_groups
+                if rng.random() < 0.5
+            },
+        }
+        if rng.random() < 0.8:
+            group["priority"] = rng.choice([0, 1, 5, 10, -3, 2.5])
+        user_groups.append(group)
+
+    return {
+        "logging": {"enabled": False},
+        "user_groups": user_groups,
+        "model_groups": model_groups,
+    }
+
+
+def gen_body(rng: random.Random) -> Dict[str, Any]:
+    def messages() -> List[Any]:
+        out: List[Any] = []
+        for i in range(rng.randint(0, 12)):
+            role = rng.choice(["system", "user", "assistant", "user", "tool"])
+            out.append({"role": role, "content": f"m{i}"})
+        if out and rng.random() < 0.05:
+            out.append("not a message")
+        return out
+
+    body: Dict[str, Any] = {"model": "x"}
+    if rng.random() < 0.9:
+        body["messages"] = messages()
+    for container, keys in (
+        ("metadata", ["messages", "history"]),
+        ("chat", ["messages"]),
+        ("conversation", ["messages", "chat_history"]),
+        ("data", ["all_messages"]),
+    ):
+        if rng.random() < 0.15:
+            body[container] = {rng.choice(keys): messages()}
+    if rng.random() < 0.1:
+        body["history"] = messages()
+    return body
+
+
+def gen_chat(rng: random.Random, chat_id: str, turns: int) -> List[Dict[str, Any]]:
+    """
+    One chat resent turn after turn, as Open WebUI does: mostly one or two new
+    messages, sometimes an edit or regeneration (the history is cut at that
+    message and continues from there), a content-only rewrite, a repeat, or
+    the list moving to another place in the body.
+    """
+    history: List[Dict[str, Any]] = []
+    if rng.random() < 0.5:
+        history.append({"role": "system", "content": "prompt"})
+    bodies = []
+    for turn in range(turns):
+        roll = rng.random()
+        if roll < 0.7 or not history:
+            for _ in range(rng.randint(1, 2)):
+                role = rng.choice(["user", "assistant", "user", "tool", "system"])
+                history.append({"role": role, "content": f"t{turn}"})
+        elif roll < 0.85:
+            del history[rng.randrange(len(history)) :]
+            history.append({"role": "user", "content": f"edit{turn}"})
+        elif roll < 0.93:
+            i = rng.randrange(len(history))
+            history[i] = dict(history[i], content=f"rewrite{turn}")
+        body: Dict[str, Any] = {"model": "x"}
+        if rng.random() < 0.5:
+            body["chat_id"] = chat_id
+        else:
+            body["metadata"] = {"chat_id": chat_id}
+        place = rng.random()
+        if place < 0.85:
+            body["messages"] = copy.deepcopy(history)
+        elif place < 0.95:
+            body.setdefault("metadata", {})["history"] = copy.deepcopy(history)
+        else:
+            body["messages"] = copy.deepcopy(history)
+            body["chat"] = {"messages": copy.deepcopy(history) + [{"role": "user"}]}
+        bodies.append(body)
+    return bodies
+
+
+def gen_stream(rng: random.Random, start: float, length: int) -> List[float]:
+    """Bursty, time-sorted request times, with hits landing on exact window edges."""
+    out: List[float] = []
+    t = start
+    for _ in range(length):
+        roll = rng.random()
+        if roll < 0.5:
+            t += rng.choice([0, 1, 2, 5])
+        elif roll < 0.8:
+            t += rng.choice([59, 60, 61, 3599, 3600, 3601])
+        else:
+            t += rng.uniform(0, 900)
+        out.append(t)
+    return out
+
+
+# ----------------------------
+# Engines under test
+# ----------------------------
+class Clock:
+    __slots__ = ("now",)
+
+    def __init__(self, now: float = 1_700_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class Engine:
+    """Runs one engine's cases and keeps reference / fast timings apart."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.cases = 0
+        self.reference_seconds = 0.0
+        self.fast_seconds = 0.0
+        self.mismatches: List[Dict[str, Any]] = []
+
+    def compare(
+        self,
+        reference: Callable[[], Any],
+        fast: Callable[[], Any],
+        context: Callable[[], Dict[str, Any]],
+    ) -> None:
+        started = time.perf_counter()
+        expected = reference()
+        middle = time.perf_counter()
+        actual = fast()
+        self.fast_seconds += time.perf_counter() - middle
+        self.reference_seconds += middle - started
+        self.cases += 1
+        if expected != actual:
+            entry = context()
+            entry.update({"expected": expected, "actual": actual})
+            self.mismatches.append(entry)
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "cases": self.cases,
+            "mismatches": len(self.mismatches),
+            "reference_seconds": round(self.reference_seconds, 4),
+            "fast_seconds": round(self.fast_seconds, 4),
+            "speedup": (
+                round(self.reference_seconds / self.fast_seconds, 2)
+                if self.fast_seconds
+                else None
+            ),
+            "first_mismatch": self.mismatches[0] if self.mismatches else None,
+        }
+
+
+def load_policy(f: Filter, cfg: Dict[str, Any]) -> Any:
+    f.valves.config_json = json.dumps(cfg)
+    return f._get_policy()
+
+
+def fuzz_case(
+    rng: random.Random, case: int, engines: Dict[str, Engine], lookups: int
+) -> None:
+    clock = Clock()
+    f = Filter(clock=clock)
+    emails = [f"user{i}@fuzz.invalid" for i in range(12)]
+    policy = load_policy(f, gen_config(rng, emails))
+    cfg = policy.cfg
+
+    engine = engines.get("variants")
+    if engine is not None:
+        for _ in range(lookups):
+            model = gen_model_id(rng)
+            engine.compare(
+                lambda: ref_model_id_variants(model),
+                lambda: f._model_id_variants(model),
+                lambda: {"case": case, "model_id": model},
+            )
+
+    engine = engines.get("user_group")
+    if engine is not None:
+        for _ in range(lookups):
+            email = gen_email(rng, emails + ["nobody@fuzz.invalid"])
+            engine.compare(
+                lambda: id(ref_get_user_group(cfg, email)),
+                lambda: id(f._get_user_group(policy, email).raw),
+                lambda: {"case": case, "email": email, "config": cfg},
+            )
+
+    engine = engines.get("model_group")
+    if engine is not None:
+        for _ in range(lookups):
+            model = gen_model_field(rng)
+
+            def fast_model_group() -> Optional[int]:
+                mg = f._get_model_group(policy, model)
+                return id(mg.raw) if mg is not None else None
+
+            def ref_model_group() -> Optional[int]:
+                group = ref_get_model_group(cfg, model)
+                return id(group) if group is not None else None
+
+            engine.compare(
+                ref_model_group,
+                fast_model_group,
+                lambda: {"case": case, "model": model, "config": cfg},
+            )
+
+    engine = engines.get("rate_limit")
+    if engine is not None:
+        raw = gen_limits(rng)
+        limits = f._compile_limits(raw, "fuzz")
+        history: List[float] = []
+        for now in gen_stream(rng, clock.now, lookups * 10):
+            clock.now = now
+            history = f._trim_history(history)
+
+            def fast_check() -> Tuple[bool, Optional[str]]:
+                return f._check_specific_limit("Fuzz", limits, history)[:2]
+
+            engine.compare(
+                lambda: ref_check_specific_limit("Fuzz", raw, history, now),
+                fast_check,
+                lambda: {
+                    "case": case,
+                    "limits": raw,
+                    "now": now,
+                    "history": list(history),
+                },
+            )
+            if rng.random() < 0.8:
+                history.append(now)
+
+    engine = engines.get("clip")
+    if engine is not None:
+        # Half single bodies, half turns of one chat (incremental clipping).
+        ug = rng.choice(policy.user_groups)
+        mg = rng.choice([None] + policy.model_groups)
+        bodies = [gen_body(rng) for _ in range(lookups - lookups // 2)]
+        bodies += gen_chat(rng, f"chat-{case}", lookups // 2)
+        for body in bodies:
+            if "chat_id" not in body and "metadata" not in body or rng.random() < 0.1:
+                ug = rng.choice(policy.user_groups)
+                mg = rng.choice([None] + policy.model_groups)
+            perm = policy.matrix[ug.index][mg.index + 1 if mg else 0]
+            expected_body = copy.deepcopy(body)
+            actual_body = copy.deepcopy(body)
+
+            def ref_clip() -> Any:
+                ref_apply_context_clip(
+                    expected_body,
+                    ref_effective_permissions(ug.raw, mg.raw if mg else None),
+                )
+                return expected_body
+
+            def fast_clip() -> Any:
+                f._apply_context_clip(cfg, actual_body, ug, mg, perm)
+                return actual_body
+
+            engine.compare(
+                ref_clip,
+                fast_clip,
+                lambda: {
+                    "case": case,
+                    "user_group": ug.id,
+                    "model_group": mg.id if mg else None,
+                    "body": body,
+                },
+            )
+
+
+ENGINES = ("variants", "user_group", "model_group", "rate_limit", "clip")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--cases", type=int, default=500)
+    parser.add_argument("--lookups", type=int, default=50, help="checks per config")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--engine", choices=("all",) + ENGINES, default="all")
+    args = parser.parse_args(argv)
+
+    names = ENGINES if args.engine == "all" else (args.engine,)
+    engines = {name: Engine(name) for name in names}
+    rng = random.Random(args.seed)
+    for case in range(args.cases):
+        fuzz_case(rng, case, engines, args.lookups)
+
+    report = {
+        "seed": args.seed,
+        "cases": args.cases,
+        "engines": {name: e.report() for name, e in engines.items()},
+    }
+    print(json.dumps(report, indent=2, ensure_ascii=False, default=str))
+    return 1 if any(e.mismatches for e in engines.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
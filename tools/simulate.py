@@ -0,0 +1,370 @@
+"""
+Capacity-planning simulator for OpenAccess Guard.
+
+Replays synthetic traffic through `Filter.inlet` on a virtual clock and
+predicts rejection, fallback and queueing rates for a given config.
+
+Usage:
+    python tools/simulate.py config.json traffic.json [--hours 24] [--seed 1]
+
+Traffic spec (JSON, comments allowed like the config itself):
+
+    {
+      "groups": {
+        "default": {"users": 9000, "process": "poisson", "rate_per_hour": 2,
+                    "models": ["llama3:8b"]},
+        "pro": {"users": 1000, "process": "bursty", "rate_per_hour": 6,
+                "burst_size": 4, "burst_gap": 3, "models": ["gpt-4o"]},
+        "night": {"users": 200, "process": "diurnal", "rate_per_hour": 3,
+                  "peak_hour": 14, "amplitude": 0.8, "models": ["gpt-4o"]}
+      },
+      "backends": {"gpt-4o": {"concurrency": 8, "service_time": 12}}
+    }
+
+Group keys are `user_groups[].id` values. Users of a group take the exact
+addresses configured on it, one each; the rest get synthetic
+`sim-<group>-<n>@...` addresses under the group's domain rules ("*@corp.com",
+"*@*.corp.com"), so they resolve like real users. A group with neither gets
+addresses under `domain` (default `sim.invalid`); one with only exact
+addresses reuses them in turn. Backends are keyed by the model id a request is
+finally sent to (after fallback or routing); each one is modelled as
+`concurrency` slots with an exponential service time of mean `service_time`
+seconds, which is where the queueing numbers come from. `outlet` runs when a
+request's slot finishes (immediately for models without a backend), so
+in-flight counts, routing and adaptive limits see completions in time order.
+"""
+
+import argparse
+import asyncio
+import heapq
+import json
+import math
+import os
+import random
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from oag import Filter  # noqa: E402
+
+
+class VirtualClock:
+    """Time source handed to `Filter(clock=...)`; advanced by the simulator."""
+
+    __slots__ = ("now",)
+
+    def __init__(self, start: float = 0.0):
+        self.now = start
+
+    def __call__(self) -> float:
+        return self.now
+
+
+# ----------------------------
+# Arrival processes
+# ----------------------------
+def poisson_arrivals(rng: random.Random, rate: float, horizon: float) -> List[float]:
+    """Homogeneous Poisson process with `rate` arrivals per second."""
+    out: List[float] = []
+    if rate <= 0:
+        return out
+    t = rng.expovariate(rate)
+    while t < horizon:
+        out.append(t)
+        t += rng.expovariate(rate)
+    return out
+
+
+def bursty_arrivals(
+    rng: random.Random,
+    rate: float,
+    horizon: float,
+    burst_size: int,
+    burst_gap: float,
+) -> List[float]:
+    """
+    Bursts start as a Poisson process; each burst fires a geometric number of
+    requests (mean `burst_size`) spaced by exponential gaps of mean `burst_gap`.
+    The long-run rate still matches `rate`.
+    """
+    out: List[float] = []
+    burst_size = max(1, int(burst_size))
+    if rate <= 0:
+        return out
+    burst_rate = rate / burst_size
+    p_stop = 1.0 / burst_size
+    t = rng.expovariate(burst_rate)
+    while t < horizon:
+        s = t
+        while s < horizon:
+            out.append(s)
+            if rng.random() < p_stop:
+                break
+            s += rng.expovariate(1.0 / burst_gap) if burst_gap > 0 else 0.0
+        t += rng.expovariate(burst_rate)
+    out.sort()
+    return out
+
+
+def diurnal_arrivals(
+    rng: random.Random,
+    rate: float,
+    horizon: float,
+    peak_hour: float,
+    amplitude: float,
+    start: float,
+) -> List[float]:
+    """
+    Non-homogeneous Poisson process with a sinusoidal daily profile, sampled by
+    thinning. `rate` is the daily mean; `amplitude` in [0, 1] sets the swing.
+    """
+    amplitude = min(max(amplitude, 0.0), 1.0)
+    peak = rate * (1.0 + amplitude)
+    out: List[float] = []
+    if peak <= 0:
+        return out
+    t = rng.expovariate(peak)
+    while t < horizon:
+        hour = ((start + t) / 3600.0) % 24.0
+        current = rate * (
+            1.0 + amplitude * math.cos(2 * math.pi * (hour - peak_hour) / 24.0)
+        )
+        if rng.random() * peak < current:
+            out.append(t)
+        t += rng.expovariate(peak)
+    return out
+
+
+# ----------------------------
+# Simulator
+# ----------------------------
+class CapacitySimulator:
+    def __init__(
+        self,
+        config: Dict[str, Any],
+        traffic: Dict[str, Any],
+        hours: float = 24.0,
+        seed: int = 0,
+        start: float = 1_700_000_000.0,
+    ):
+        self.clock = VirtualClock(start)
+        self.filter = Filter(clock=self.clock)
+        self.filter.valves.config_json = json.dumps(config, ensure_ascii=False)
+        self.traffic = traffic
+        self.horizon = hours * 3600.0
+        self.start = start
+        self.rng = random.Random(seed)
+
+    def _group_emails(self, group_id: str, count: int, domain: str) -> List[str]:
+        exact: List[str] = []
+        domains: List[str] = []
+        cfg = self.filter._get_cfg()
+        for group in cfg.get("user_groups", []) or []:
+            if not isinstance(group, dict) or group.get("id") != group_id:
+                continue
+            for entry in group.get("emails", []) or []:
+                if not isinstance(entry, str):
+                    continue
+                entry = entry.strip()
+                if entry.startswith("*@*."):
+                    domains.append("sim." + entry[4:])
+                elif entry.startswith("*@"):
+                    domains.append(entry[2:])
+                elif "@" in entry and "*" not in entry:
+                    exact.append(entry)
+        if exact and not domains:
+            return [exact[i % len(exact)] for i in range(count)]
+        domains = domains or [domain]
+        emails = exact[:count]
+        for i in range(len(emails), count):
+            emails.append(f"sim-{group_id}-{i}@{domains[i % len(domains)]}")
+        return emails
+
+    def _is_fallback(self, model: str, target: str) -> bool:
+        """True if `target` came from a fallback, not from `routing`."""
+        if target == model:
+            return False
+        f = self.filter
+        group = f._get_model_group(f._get_policy(), model)
+        return not (group is not None and group.routing and target in group.replicas)
+
+    def _arrivals(self, spec: Dict[str, Any]) -> List[float]:
+        rate = float(spec.get("rate_per_hour", 1.0)) / 3600.0
+        process = spec.get("process", "poisson")
+        if process == "bursty":
+            return bursty_arrivals(
+                self.rng,
+                rate,
+                self.horizon,
+                int(spec.get("burst_size", 4)),
+                float(spec.get("burst_gap", 2.0)),
+            )
+        if process == "diurnal":
+            return diurnal_arrivals(
+                self.rng,
+                rate,
+                self.horizon,
+                float(spec.get("peak_hour", 14.0)),
+                float(spec.get("amplitude", 0.8)),
+                self.start,
+            )
+        if process != "poisson":
+            raise ValueError(f"Unknown arrival process: {process}")
+        return poisson_arrivals(self.rng, rate, self.horizon)
+
+    def build_events(self) -> Tuple[List[Tuple[float, int, str]], List[Dict[str, Any]]]:
+        """Returns (sorted events of (offset, user_index, model), users)."""
+        events: List[Tuple[float, int, str]] = []
+        users: List[Dict[str, Any]] = []
+        for group_id, spec in (self.traffic.get("groups") or {}).items():
+            count = int(spec.get("users", 1))
+            models = spec.get("models") or ["default"]
+            emails = self._group_emails(
+                group_id, count, spec.get("domain", "sim.invalid")
+            )
+            for i in range(count):
+                idx = len(users)
+                users.append(
+                    {
+                        "group": group_id,
+                        "user": {
+                            "id": f"sim-{group_id}-{i}",
+                            "email": emails[i],
+                            "role": "user",
+                        },
+                    }
+                )
+                for t in self._arrivals(spec):
+                    events.append((t, idx, self.rng.choice(models)))
+        events.sort()
+        return events, users
+
+    async def run(self) -> Dict[str, Any]:
+        events, users = self.build_events()
+        backends = self.traffic.get("backends") or {}
+        slots: Dict[str, List[float]] = {
+            model: [0.0] * max(1, int(spec.get("concurrency", 1)))
+            for model, spec in backends.items()
+        }
+        stats: Dict[str, Dict[str, Any]] = {}
+        reasons: Dict[str, int] = {}
+
+        def group_stats(group: str) -> Dict[str, Any]:
+            if group not in stats:
+                stats[group] = {
+                    "requests": 0,
+                    "accepted": 0,
+                    "rejected": 0,
+                    "fallback": 0,
+                    "queued": 0,
+                    "wait_total": 0.0,
+                    "wait_max": 0.0,
+                }
+            return stats[group]
+
+        # (finish time, seq, requested model, request id, user) per request
+        # still holding a backend slot; drained before each later arrival.
+        completions: List[Tuple[float, int, str, str, Dict[str, Any]]] = []
+
+        async def complete_until(t: float) -> None:
+            while completions and completions[0][0] <= t:
+                done, _, model, request_id, user = heapq.heappop(completions)
+                self.clock.now = done
+                await self.filter.outlet(
+                    {"model": model, "chat_id": request_id, "id": request_id},
+                    __user__=user,
+                )
+
+        for seq, (offset, idx, model) in enumerate(events):
+            now = self.start + offset
+            await complete_until(now)
+            self.clock.now = now
+            entry = users[idx]
+            st = group_stats(entry["group"])
+            st["requests"] += 1
+            request_id = f"sim-{seq}"
+            body = {
+                "model": model,
+                "messages": [{"role": "user", "content": request_id}],
+                "metadata": {"chat_id": request_id, "message_id": request_id},
+            }
+            try:
+                body = await self.filter.inlet(body, __user__=entry["user"])
+            except Exception as e:
+                st["rejected"] += 1
+                reasons[str(e)] = reasons.get(str(e), 0) + 1
+                continue
+            st["accepted"] += 1
+            target = body.get("model", model)
+            if self._is_fallback(model, target):
+                st["fallback"] += 1
+
+            heap = slots.get(target)
+            finish = now
+            if heap is not None:
+                free_at = heapq.heappop(heap)
+                begin = max(now, free_at)
+                wait = begin - now
+                if wait > 0:
+                    st["queued"] += 1
+                    st["wait_total"] += wait
+                    st["wait_max"] = max(st["wait_max"], wait)
+                mean = float(backends[target].get("service_time", 1.0))
+                finish = begin + (self.rng.expovariate(1.0 / mean) if mean > 0 else 0.0)
+                heapq.heappush(heap, finish)
+            heapq.heappush(completions, (finish, seq, model, request_id, entry["user"]))
+        await complete_until(float("inf"))
+
+        report: Dict[str, Any] = {
+            "events": len(events),
+            "users": len(users),
+            "groups": {},
+        }
+        for group, st in stats.items():
+            n = st["requests"] or 1
+            report["groups"][group] = {
+                "requests": st["requests"],
+                "rejection_rate": st["rejected"] / n,
+                "fallback_rate": st["fallback"] / n,
+                "queueing_rate": st["queued"] / n,
+                "mean_wait": st["wait_total"] / st["queued"] if st["queued"] else 0.0,
+                "max_wait": st["wait_max"],
+            }
+        report["reasons"] = dict(sorted(reasons.items(), key=lambda kv: -kv[1]))
+        return report
+
+
+def _load_json(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as fh:
+        raw = fh.read()
+    try:
+        return json.loads(raw)
+    except json.JSONDecodeError:
+        return json.loads(Filter._strip_json_comments(raw))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("config")
+    parser.add_argument("traffic")
+    parser.add_argument("--hours", type=float, default=24.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    sim = CapacitySimulator(
+        _load_json(args.config),
+        _load_json(args.traffic),
+        hours=args.hours,
+        seed=args.seed,
+    )
+    started = time.perf_counter()
+    report = asyncio.run(sim.run())
+    report["elapsed_seconds"] = round(time.perf_counter() - started, 3)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())